@@ -0,0 +1,78 @@
+from os import getenv
+from time import perf_counter
+from typing import Callable, Iterable, List
+
+from pymongo import MongoClient
+from pymongo.database import Database
+
+from src.indexes import INDEXES
+
+SEED_BATCH_SIZE = 10_000
+
+def get_bench_database() -> Database:
+    """
+        A throwaway database on `MONGO_URI`, never point this at a database the service uses.
+        Seeded collections are kept between runs so a large seed only has to happen once.
+    """
+
+    client = MongoClient(getenv("MONGO_URI", "mongodb://localhost:27017"))
+
+    return client[getenv("BENCH_DATABASE", "delve_bench")]
+
+def apply_indexes(db : Database, *collections : str) -> None:
+    """Creates the service's real indexes on the given collections"""
+
+    for collection in collections:
+        db.get_collection(collection).create_indexes(INDEXES[collection])
+
+def seed(db : Database, collection : str, docs : Iterable[dict], total : int) -> None:
+    """Bulk inserts `docs` in batches into a freshly indexed collection, skipping the seed if it already holds `total` documents"""
+
+    coll = db.get_collection(collection)
+
+    if coll.estimated_document_count() >= total:
+        return
+
+    # Dropping takes the indexes with it, they're rebuilt before the seed so every run measures indexed queries
+    coll.drop()
+
+    if collection in INDEXES:
+        apply_indexes(db, collection)
+
+    batch = []
+    inserted = 0
+
+    for doc in docs:
+        batch.append(doc)
+
+        if len(batch) == SEED_BATCH_SIZE:
+            coll.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+
+            print(f"\rseeding {collection}: {inserted}/{total}", end="", flush=True)
+
+    if batch:
+        coll.insert_many(batch, ordered=False)
+
+    print(f"\rseeded {collection}: {total}{' ' * 16}")
+
+def time_calls(f : Callable[[], object], runs : int) -> List[float]:
+    """Wall time of each of `runs` calls, in ms"""
+
+    samples = []
+
+    for _ in range(runs):
+        start = perf_counter()
+        f()
+        samples.append((perf_counter() - start) * 1000)
+
+    return samples
+
+def report(name : str, samples : List[float]) -> None:
+    samples = sorted(samples)
+
+    def pct(p : float) -> float:
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    print(f"{name:<36}p50 {pct(0.5):>9.2f} ms  p95 {pct(0.95):>9.2f} ms  p99 {pct(0.99):>9.2f} ms  (n={len(samples)})")
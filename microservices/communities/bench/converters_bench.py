@@ -0,0 +1,110 @@
+"""
+    Times `message_converter.from_mongo` against the old recursive `objectid_fix`
+    on a page of realistic message documents.
+
+    Run from microservices/communities: `python -m bench.converters_bench`
+"""
+
+from datetime import datetime, UTC
+from timeit import repeat
+from typing import Literal
+
+from bson import ObjectId
+
+from src.converters import message_converter
+
+PAGE_SIZE = 100
+NUMBER = 200
+REPEAT = 5
+
+def objectid_fix(d : dict, *, desired_outcome : Literal["oid", "str"] = "oid") -> dict:
+    """The helper `DocumentConverter` replaced, kept here as the baseline"""
+    # This is actually a horrible function
+
+    tmp = {}
+
+    if not isinstance(d, dict):
+        return d
+
+    for k, v in d.items():
+
+        if k == "id" and desired_outcome == "oid":
+            tmp["_id"] = ObjectId(v)
+
+        elif k == "_id" and desired_outcome == "str":
+            tmp["id"] = str(v)
+
+        elif "id" in k:
+
+            if desired_outcome == "oid":
+
+                if isinstance(v, list) and all([ObjectId.is_valid(vx) for vx in v]):
+                    tmp[k] = [ObjectId(vx) for vx in v]
+
+                elif ObjectId.is_valid(v):
+                    tmp[k] = ObjectId(v)
+
+                else:
+                    tmp[k] = v
+
+            elif desired_outcome == "str":
+
+                if isinstance(v, list) and all([isinstance(vx, ObjectId) for vx in v]):
+                    tmp[k] = [str(vx) for vx in v]
+
+                elif isinstance(v, ObjectId):
+                    tmp[k] = str(v)
+
+                else:
+                    tmp[k] = v
+
+        elif isinstance(v, dict):
+            tmp[k] = objectid_fix(v, desired_outcome=desired_outcome)
+
+        elif isinstance(v, list):
+            tmp[k] = [objectid_fix(vi, desired_outcome=desired_outcome) for vi in v]
+
+        else:
+            tmp[k] = v
+
+    return tmp
+
+def make_page(n : int = PAGE_SIZE) -> list:
+    community_id, channel_id = ObjectId(), ObjectId()
+    authors = [ObjectId() for _ in range(10)]
+
+    return [
+        {
+            "_id" : ObjectId(),
+            "author_id" : authors[i % len(authors)],
+            "channel_id" : channel_id,
+            "community_id" : community_id,
+            "content" : {"text" : f"message {i} for <@{authors[(i + 1) % len(authors)]}>"},
+            "mentions" : [f"@{authors[(i + 1) % len(authors)]}"],
+            "created_at" : datetime.now(UTC)
+        }
+        for i in range(n)
+    ]
+
+def report(name : str, timings : list) -> float:
+    per_page = min(timings) / NUMBER
+    print(f"{name:<28}{per_page * 1e6:>10.1f} us/page {per_page * 1e6 / PAGE_SIZE:>8.2f} us/doc")
+
+    return per_page
+
+def main() -> None:
+    page = make_page()
+
+    baseline = report(
+        "objectid_fix",
+        repeat(lambda: [objectid_fix(d, desired_outcome="str") for d in page], number=NUMBER, repeat=REPEAT)
+    )
+    converter = report(
+        "message_converter",
+        repeat(lambda: [message_converter.from_mongo(d) for d in page], number=NUMBER, repeat=REPEAT)
+    )
+
+    print(f"speedup {baseline / converter:.1f}x")
+
+if __name__ == "__main__":
+    main()
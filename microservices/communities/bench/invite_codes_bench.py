@@ -0,0 +1,105 @@
+"""
+    Invite code allocation latency as the number of live invites grows, the old lookup-then-insert
+    against insert-and-retry on the unique `invite_code` index.
+
+    Run from microservices/communities: `python -m bench.invite_codes_bench`
+"""
+
+import string
+from argparse import ArgumentParser
+from datetime import datetime, UTC
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from src.constants import INVITE_CODE_ATTEMPTS, INVITE_CODE_LENGTH
+from src.subroutes.invites import generate_invite_code
+
+from .common import SEED_BATCH_SIZE, apply_indexes, get_bench_database, report, time_calls
+
+CODE_SPACE = len(string.ascii_letters) ** INVITE_CODE_LENGTH
+
+# Coprime with the code space, so `i * SEED_MULTIPLIER % CODE_SPACE` visits every code once
+# and the seeded codes are unique without having to remember them
+SEED_MULTIPLIER = 1_000_003
+
+def seed_code(i : int) -> str:
+    n = i * SEED_MULTIPLIER % CODE_SPACE
+    code = []
+
+    for _ in range(INVITE_CODE_LENGTH):
+        n, r = divmod(n, len(string.ascii_letters))
+        code.append(string.ascii_letters[r])
+
+    return "".join(code)
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--invites", type=int, default=10_000_000)
+    parser.add_argument("--steps", type=int, default=5, help="fill levels to measure at, evenly up to --invites")
+    parser.add_argument("--runs", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = get_bench_database()
+    apply_indexes(db, "invites")
+
+    invites = db.get_collection("invites")
+    community_id, author_id = ObjectId(), ObjectId()
+    now = datetime.now(UTC)
+
+    # Every allocation the benchmark makes, removed after each level so the seed stays reusable
+    allocated = []
+    retries = [0]
+
+    def doc(code : str) -> dict:
+        return {"_id" : ObjectId(), "community_id" : community_id, "author_id" : author_id, "invite_code" : code, "created_at" : now}
+
+    def lookup_then_insert():
+        for _ in range(3):
+            code = generate_invite_code()
+
+            if not invites.find_one({"invite_code" : code}):
+                break
+
+            retries[0] += 1
+
+        d = doc(code)
+        invites.insert_one(d)
+        allocated.append(d["_id"])
+
+    def insert_and_retry():
+        for _ in range(INVITE_CODE_ATTEMPTS):
+            d = doc(generate_invite_code())
+
+            try:
+                invites.insert_one(d)
+            except DuplicateKeyError:
+                retries[0] += 1
+                continue
+
+            allocated.append(d["_id"])
+            break
+
+    for step in range(1, args.steps + 1):
+        level = args.invites * step // args.steps
+        count = invites.estimated_document_count()
+
+        while count < level:
+            batch = [doc(seed_code(i)) for i in range(count, min(level, count + SEED_BATCH_SIZE))]
+            invites.insert_many(batch, ordered=False)
+            count += len(batch)
+
+            print(f"\rseeding invites: {count}/{level}", end="", flush=True)
+
+        print(f"\r{level} live invites ({level / CODE_SPACE:.4%} of the code space){' ' * 16}")
+
+        for name, f in (("find_one then insert", lookup_then_insert), ("insert and retry", insert_and_retry)):
+            retries[0] = 0
+            report(f"  {name}", time_calls(f, args.runs))
+            print(f"  {'':<34}{retries[0]} collisions")
+
+            invites.delete_many({"_id" : {"$in" : allocated}})
+            allocated.clear()
+
+if __name__ == "__main__":
+    main()
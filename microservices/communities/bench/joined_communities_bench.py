@@ -0,0 +1,78 @@
+"""
+    GET /list at scale, the old `$lookup` from every community against starting from the
+    user's memberships and fetching their communities with `$in` (as `get_joined_community_ids`
+    and `get_community_snapshots` do, without the caches in front of them).
+
+    Run from microservices/communities: `python -m bench.joined_communities_bench`
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime, UTC
+
+from bson import ObjectId
+
+from .common import apply_indexes, get_bench_database, report, seed, time_calls
+
+# The user whose communities are listed, fixed so a kept seed can be reused
+BENCH_USER_ID = ObjectId("0" * 23 + "1")
+
+def community_ids(n : int) -> list:
+    # Deterministic ids so the members seed lines up with a kept communities seed
+    return [ObjectId(f"{i:024x}") for i in range(1, n + 1)]
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--communities", type=int, default=1_000_000)
+    parser.add_argument("--members-per-community", type=int, default=3)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--joined", type=int, default=20, help="communities the listed user is a member of")
+    parser.add_argument("--lookup-runs", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    db = get_bench_database()
+
+    ids = community_ids(args.communities)
+    users = [ObjectId() for _ in range(args.users)]
+    now = datetime.now(UTC)
+    stride = max(1, args.communities // args.joined)
+
+    def communities():
+        for i, cid in enumerate(ids):
+            yield {"_id" : cid, "name" : f"community {i}", "owner_id" : users[i % len(users)], "roles" : [], "created_at" : now}
+
+    def members():
+        for i, cid in enumerate(ids):
+            for j in range(args.members_per_community):
+                yield {"_id" : ObjectId(), "community_id" : cid, "user_id" : users[(i + j) % len(users)], "role_ids" : []}
+
+        for cid in ids[::stride][:args.joined]:
+            yield {"_id" : ObjectId(), "community_id" : cid, "user_id" : BENCH_USER_ID, "role_ids" : []}
+
+    seed(db, "communities", communities(), args.communities)
+    seed(db, "members", members(), args.communities * args.members_per_community + args.joined)
+
+    # Also covers a kept seed from before an index was added
+    apply_indexes(db, "communities", "members")
+
+    def lookup():
+        return list(db.get_collection("communities").aggregate([
+            {"$lookup" : {"from" : "members", "localField" : "_id", "foreignField" : "community_id", "as" : "community_members"}},
+            {"$match" : {"community_members" : {"$elemMatch" : {"user_id" : BENCH_USER_ID}}}},
+            {"$project" : {"community_members" : 0}}
+        ]))
+
+    def from_members():
+        joined = [m["community_id"] for m in db.get_collection("members").find({"user_id" : BENCH_USER_ID}, {"community_id" : 1, "_id" : 0})]
+
+        return list(db.get_collection("communities").find({"_id" : {"$in" : joined}}))
+
+    assert len(lookup()) == len(from_members()) == args.joined
+
+    print(f"{args.communities} communities, {args.members_per_community} members each, user in {args.joined}")
+
+    report("$lookup over every community", time_calls(lookup, args.lookup_runs))
+    report("members by user_id + $in", time_calls(from_members, args.runs))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+    Role operations on a community with 250 roles.
+
+    Always times `reorder_roles` against the old `sorted(..., key=roles_arr.index)` reorder.
+    With `--mongo` it also times a single role edit, as a positional `$set` on the one role against
+    the old read of the community followed by a `$set` of the whole roles array.
+
+    Run from microservices/communities: `python -m bench.roles_bench`
+"""
+
+import random
+from argparse import ArgumentParser
+from timeit import repeat
+
+from bson import ObjectId
+
+from src.converters import role_converter
+from src.subroutes.roles import reorder_roles
+from delve_common._types._dtos._communities._role import Role
+
+from .common import get_bench_database, report, time_calls
+
+NUMBER = 100
+REPEAT = 5
+
+def old_reorder(roles_arr : list, role_pos_tuple_pair : dict) -> list:
+    """The reorder `update_role_positions` used to do over the raw roles array"""
+
+    return sorted(
+        roles_arr,
+        key = lambda n: (
+            roles_arr.index(n)
+            if str(n["_id"]) not in role_pos_tuple_pair
+            else role_pos_tuple_pair[str(n["_id"])]
+        )
+    )
+
+def make_roles(n : int) -> list:
+    return [
+        Role(id=str(ObjectId()), name=f"role {i}", colour=random.randrange(0xFFFFFF), permission_overrides={"send_messages" : True})
+        for i in range(n)
+    ]
+
+def bench_reorder(roles : list) -> None:
+    docs = [role_converter.dump(r) for r in roles]
+    n = len(roles)
+
+    cases = {
+        "move one role to the top" : {roles[-1].id : 0},
+        f"move {n // 10} roles" : {r.id : random.randrange(n) for r in random.sample(roles, n // 10)},
+        f"reverse all {n} roles" : {r.id : n - i - 1 for i, r in enumerate(roles)}
+    }
+
+    for name, requested in cases.items():
+        old = min(repeat(lambda: old_reorder(docs, requested), number=NUMBER, repeat=REPEAT)) / NUMBER
+        new = min(repeat(lambda: reorder_roles(roles, requested), number=NUMBER, repeat=REPEAT)) / NUMBER
+
+        print(f"{name:<28}old {old * 1e6:>9.1f} us  new {new * 1e6:>9.1f} us  ({old / new:.1f}x)")
+
+def bench_edit(roles : list, runs : int) -> None:
+    db = get_bench_database()
+    communities = db.get_collection("communities")
+
+    community_id = ObjectId()
+    communities.insert_one({"_id" : community_id, "name" : "roles bench", "roles" : [role_converter.dump(r) for r in roles]})
+
+    def whole_array():
+        doc = communities.find_one({"_id" : community_id})
+        target = random.randrange(len(doc["roles"]))
+        doc["roles"][target]["colour"] = random.randrange(0xFFFFFF)
+        communities.update_one({"_id" : community_id}, {"$set" : {"roles" : doc["roles"]}})
+
+    def positional():
+        communities.find_one_and_update(
+            {"_id" : community_id, "roles._id" : ObjectId(random.choice(roles).id)},
+            {"$set" : {"roles.$.colour" : random.randrange(0xFFFFFF)}, "$inc" : {"version" : 1}},
+            projection={"roles.$" : 1}
+        )
+
+    try:
+        report("edit, read + $set whole array", time_calls(whole_array, runs))
+        report("edit, positional $set", time_calls(positional, runs))
+    finally:
+        communities.delete_one({"_id" : community_id})
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--roles", type=int, default=250)
+    parser.add_argument("--mongo", action="store_true", help="also time role edits against MONGO_URI")
+    parser.add_argument("--runs", type=int, default=500)
+    args = parser.parse_args()
+
+    roles = make_roles(args.roles)
+
+    bench_reorder(roles)
+
+    if args.mongo:
+        bench_edit(roles, args.runs)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-from fastapi import Depends, FastAPI, Body
+import asyncio
+from fastapi import Depends, FastAPI, Body, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Annotated, List
+from typing import Annotated, Dict, List, Optional
 from datetime import datetime, UTC
 from bson import ObjectId
 from pymongo import ReturnDocument
@@ -9,9 +10,27 @@ from delve_common._db._database import Database, get_database
 from delve_common._db._redis import get_redis, DelveRedis
 from delve_common.exceptions import DelveHTTPException
 
-from .constants import X_USER_HEADER
-from .models import CommunityCreationRequest, CommunityEditRequest
-from .utils import dump_basemodel_to_json_bytes, objectid_fix
+from .constants import X_USER_HEADER, CHANNEL_POSITION_SEQ_FIELD
+from .models import CommunityCreationRequest, CommunityDeletionStatus, CommunityEditRequest
+from .utils import dump_basemodel_to_json_bytes, queue_modified_events
+from .diffs import model_delta
+from .events import CommunityDeltaEvent
+from .converters import channel_converter, community_converter, member_converter
+from .indexes import Indexes
+from .join_events import MemberJoinCoalescer
+from .invite_usage import InviteUsageFlusher
+from .deletion import DELETIONS_COLLECTION, CommunityPurger, create_tombstone
+from .read_state import get_unread_counts
+from .cache import (
+    COMMUNITY_VERSION_FIELD,
+    CacheInvalidator,
+    community_etag,
+    get_community_snapshot,
+    get_community_snapshots,
+    get_joined_community_ids,
+    invalidate_community,
+    invalidate_joined_communities
+)
 
 from delve_common._types._dtos._communities import Community
 from delve_common._types._dtos._communities._channel import Channel
@@ -44,6 +63,11 @@ app.add_middleware(
 
 Database.using_app(app)
 DelveRedis.using_app(app)
+CacheInvalidator.using_app(app)
+MemberJoinCoalescer.using_app(app)
+InviteUsageFlusher.using_app(app)
+CommunityPurger.using_app(app)
+Indexes.using_app(app)
 
 @app.post("/")
 async def create_community(
@@ -57,21 +81,67 @@ async def create_community(
     # Store the community id for nested list comprehensions
     comm_id = ObjectId()
 
-    # Build that big community object
+    channels = [
+        Channel(
+            id=str(ObjectId()),
+            community_id=str(comm_id),
+            name = chan.name
+        )
+        for chan in creationReq.template.channels
+    ]
+
+    # Roles live embedded on the community, where everything else reads them from
+    roles = [
+        Role(
+            id=str(ObjectId()),
+            community_id=str(comm_id),
+            **role.model_dump()
+        )
+        for role in creationReq.template.roles
+    ]
+
+    # Build that big community object, with every id known up front
     comm = Community(
         id = str(comm_id),
         name = creationReq.name,
         owner_id = str(user_id),
-        channel_ids = [],
-        role_ids = [],
+        channel_ids = [c.id for c in channels],
+        role_ids = [r.id for r in roles],
+        roles = roles,
     )
 
-    resp = await db.get_collection("communities").insert_one(
-        objectid_fix(comm.model_dump(), desired_outcome="oid")
+    new_member = Member(
+        id=str(ObjectId()),
+        community_id=str(comm_id),
+        user_id=str(ObjectId(user_id))
     )
 
-    # If the response from the database is not an acknowledged write, raise an error
-    if not resp.acknowledged:
+    # None of the writes depend on each other, so they're sent concurrently
+    writes = [
+        db.get_collection("communities").insert_one(
+            {**community_converter.dump(comm), CHANNEL_POSITION_SEQ_FIELD : len(channels)}
+        ),
+        db.get_collection("members").insert_one(member_converter.dump(new_member)),
+    ]
+
+    if channels:
+        writes.append(db.get_collection("channels").insert_many([
+            {**channel_converter.dump(c), "position" : i} for i, c in enumerate(channels)
+        ]))
+
+    # Every write is waited on, even if one fails, so the rollback below can't race any of them
+    results = await asyncio.gather(*writes, return_exceptions=True)
+
+    # If any write failed (or wasn't acknowledged), undo the ones that went through. Every id is known up front,
+    # and deleting what was never written is harmless, so there's no need to work out which ones succeeded
+    if any(isinstance(r, BaseException) or not r.acknowledged for r in results):
+        await asyncio.gather(
+            db.get_collection("communities").delete_one({"_id" : comm_id}),
+            db.get_collection("members").delete_one({"_id" : ObjectId(new_member.id)}),
+            db.get_collection("channels").delete_many({"_id" : {"$in" : [ObjectId(c.id) for c in channels]}}),
+            return_exceptions=True
+        )
+
         raise DelveHTTPException(
             status_code=500,
             detail="Failed to create community",
@@ -81,56 +151,15 @@ async def create_community(
                 "community_dump" : comm.model_dump()
             }
         )
-    
-    created_template_channels : List[ObjectId] = []
-    created_template_roles : List[ObjectId] = []
-    
-    if creationReq.template.channels:
-
-        resp = await db.get_collection("channels").insert_many(
-            [
-                objectid_fix(Channel(
-                    id=str(ObjectId()),
-                    community_id=str(comm_id),
-                    name = chan.name
-                ).model_dump(), desired_outcome="oid") 
-                for chan in creationReq.template.channels
-            ]
-        )
-
-        created_template_channels = resp.inserted_ids
 
-    if creationReq.template.roles:
-
-        resp = await db.get_collection("roles").insert_many(
-            [
-                objectid_fix(Role(
-                    id=str(ObjectId()),
-                    community_id=str(comm_id),
-                    name = role.name,
-                    colour = role.colour
-                ).model_dump(), desired_outcome="oid")
-                for role in creationReq.template.roles
-            ]
-        )
+    invalidate_joined_communities(user_id)
 
-        created_template_roles = resp.inserted_ids
+    pipe = redis.pipeline(transaction=False)
 
-    comm = await db.get_collection("communities").find_one_and_update(
-        {"_id" : comm_id},
-        {"$set" : {
-            "role_ids" : created_template_roles,
-            "channel_ids" : created_template_channels
-        }},
-        return_document=ReturnDocument.AFTER
-    )
-
-    comm = Community(**objectid_fix(comm, desired_outcome="str"))
-    
     # Send an event to the gateway signifying that a new community was created
     # This isn't normally broadcasted to users, but may be useful for the future
     # (This is also just the first place redis was implemented anyways, because the integration is so simple)
-    await redis.publish(
+    pipe.publish(
         f"community_created.{str(comm_id)}",
         dump_basemodel_to_json_bytes(
             CommunityCreatedEvent(
@@ -140,27 +169,19 @@ async def create_community(
         )
     )
 
-    new_member = Member(
-        id=str(ObjectId()),
-        community_id=str(ObjectId(comm.id)),
-        user_id=str(ObjectId(user_id))
-    )
-
-    resp = await db.get_collection("members").insert_one(
-        objectid_fix(new_member.model_dump(), desired_outcome="oid")
-    )
-
-    await redis.publish(
-        f"member_joined.{str(comm.id)}.{user_id}",
+    pipe.publish(
+        f"member_joined.{str(comm_id)}.{user_id}",
         dump_basemodel_to_json_bytes(
             JoinedCommunityEvent(
-                community_id=str(comm.id),
+                community_id=str(comm_id),
                 user_id=user_id,
                 member=new_member
             )
         )
     )
 
+    await pipe.execute()
+
     # If all goes well, return the new community
     return comm
 
@@ -170,52 +191,33 @@ async def get_joined_communities(
 ) -> List[Community]:
     
     
-    db = await get_database()
+    # Start from the user's memberships rather than scanning every community
+    community_ids = await get_joined_community_ids(user_id)
 
-    pipeline = db.get_collection("communities").aggregate(
-        [
-            # Gather all community members
-            {
-                "$lookup" : {
-                    "from" : "members",
-                    "localField" : "_id",
-                    "foreignField" : "community_id",
-                    "as" : "community_members"
-                }
-            },
-            # Find all references to this user's id in the community_members array
-            {
-                "$match" : {
-                    "community_members" : {
-                        "$elemMatch" : {"user_id" : ObjectId(user_id)}
-                    }
-                }
-            },
-            # Remove the community members array because we only want the communities
-            {
-                "$project" : {
-                    "community_members" : 0
-                }
-            }
-        ]
-    )
+    return [community for _, community in await get_community_snapshots(community_ids)]
 
-    return [Community(**objectid_fix(d, desired_outcome="str")) async for d in pipeline]
+@app.get("/unread")
+async def get_unread_summary(
+    user_id : Annotated[str, Depends(X_USER_HEADER)]
+) -> Dict[str, Dict[str, int]]:
+    """Returns `{community_id : {channel_id : unread count}}` across every joined community"""
+
+    community_ids = await get_joined_community_ids(user_id)
+
+    return await get_unread_counts(user_id, community_ids)
 
 @app.get("/{community_id}")
 async def get_community(
     user_id : Annotated[str, Depends(X_USER_HEADER)],
-    community_id : str
+    community_id : str,
+    response : Response,
+    if_none_match : Optional[str] = Header(default=None)
 ) -> Community:
-    
-    db = await get_database()
 
     # TODO: Any user can look up any community with this simple find
-    res = await db.get_collection("communities").find_one(
-        {"_id" : ObjectId(community_id)}
-    )
+    snapshot = await get_community_snapshot(community_id)
 
-    if not res:
+    if not snapshot:
         raise DelveHTTPException(
             status_code=404,
             identifier="community_not_found",
@@ -223,7 +225,16 @@ async def get_community(
             additional_metadata={"community_id" : community_id}
         )
     
-    return Community(**objectid_fix(res, desired_outcome="str"))
+    version, community = snapshot
+    etag = community_etag(community_id, version)
+
+    # The client already has this version of the community
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag" : etag})
+
+    response.headers["ETag"] = etag
+
+    return community
 
 @app.patch("/{community_id}")
 async def update_community(
@@ -246,18 +257,17 @@ async def update_community(
         )
     
     # Get a reference to the community
-    community = await db.get_collection("communities").find_one({"_id" : ObjectId(community_id)})
+    snapshot = await get_community_snapshot(community_id)
 
     # Ensure the community exists
-    if not community:
+    if not snapshot:
         raise DelveHTTPException(
             status_code=404,
             detail="Failed to find community",
             identifier="community_not_found"
         )
     
-    # init an object to ensure everything is okay
-    before_community = Community(**objectid_fix(community, desired_outcome="str"))
+    _, before_community = snapshot
     
     # region | # TODO<advanced-perms>: This will need revision when implementing advanced permissions
     if user_id != before_community.owner_id:
@@ -270,15 +280,16 @@ async def update_community(
 
     resp = await db.get_collection("communities").find_one_and_update(
         {"_id" : ObjectId(community_id)},
-        {"$set" : {
-            "edited_at" : datetime.now(tz=UTC), # Update the edited_at field on the community
-            **diff # Push the diff into the community
-        }},
+        {
+            "$set" : {
+                "edited_at" : datetime.now(tz=UTC), # Update the edited_at field on the community
+                **diff # Push the diff into the community
+            },
+            "$inc" : {COMMUNITY_VERSION_FIELD : 1}
+        },
         return_document=ReturnDocument.AFTER # Return the document after the modification
     )
 
-    after_community = Community(**objectid_fix(resp, desired_outcome="str"))
-
     # This shouldn't happen.
     if not resp:
         raise DelveHTTPException(
@@ -287,21 +298,33 @@ async def update_community(
             identifier="nightmare_error"
         )
 
-    await redis.publish(
+    after_community = community_converter.load(resp)
+
+    invalidate_community(community_id)
+
+    pipe = redis.pipeline(transaction=False)
+
+    queue_modified_events(
+        pipe,
         f"community_modified.{community_id}",
-        dump_basemodel_to_json_bytes(
-            CommunityModifiedEvent(
-                community_id=community_id,
-                before = before_community,
-                after = after_community
-            )
+        CommunityDeltaEvent(
+            community_id=community_id,
+            version=resp[COMMUNITY_VERSION_FIELD],
+            changes=model_delta(before_community, after_community)
+        ),
+        CommunityModifiedEvent(
+            community_id=community_id,
+            before = before_community,
+            after = after_community
         )
     )
 
+    await pipe.execute()
+
     # Return the updated community
     return after_community
 
-@app.delete("/{community_id}")
+@app.delete("/{community_id}", status_code=202)
 async def delete_community(
     user_id : Annotated[str, Depends(X_USER_HEADER)],
     community_id : str
@@ -311,18 +334,17 @@ async def delete_community(
     redis = await get_redis()
 
     # Get a reference to the community
-    community = await db.get_collection("communities").find_one({"_id" : ObjectId(community_id)})
+    snapshot = await get_community_snapshot(community_id)
 
     # Ensure the community exists
-    if not community:
+    if not snapshot:
         raise DelveHTTPException(
             status_code=404,
             detail="Failed to find community",
             identifier="community_not_found"
         )
     
-    # init an object to ensure everything is okay
-    community = Community(**objectid_fix(community, desired_outcome="str"))
+    _, community = snapshot
     
     # region | # TODO<advanced-perms>: This will need revision when implementing advanced permissions
     if user_id != community.owner_id:
@@ -333,25 +355,17 @@ async def delete_community(
         )
     # endregion
 
-    # Delete the community
-    resp = await db.get_collection("communities").delete_one({"_id" : ObjectId(community_id)})
-
-    # This shouldn't happen.
-    if resp.deleted_count != 1:
+    # Tombstone the community before removing it, the purge job then owns everything that's left
+    if not await create_tombstone(community_id, user_id):
         raise DelveHTTPException(
-            status_code=500,
-            detail="Failed to delete community",
-            identifier="nightmare_error"
+            status_code=404,
+            detail="Failed to find community",
+            identifier="community_not_found"
         )
 
-    # Delete all of the other resources assoc. with the community if the community deletes succesfully
-    # NOTE: If a community is deleted, then it is ASSUMED that ALL other resources assoc. with the community
-    #       have been deleted as well. I cba to send out all of the other redis events for it.  
-    await db.get_collection("community_messages").delete_many({"community_id" : ObjectId(community_id)})
-    await db.get_collection("channels").delete_many({"community_id" : ObjectId(community_id)})
-    await db.get_collection("members").delete_many({"community_id" : ObjectId(community_id)})
-    await db.get_collection("invites").delete_many({"community_id" : ObjectId(community_id)})
-    # TODO: This needs to also delete roles when the time comes to implement them
+    await db.get_collection("communities").delete_one({"_id" : ObjectId(community_id)})
+
+    invalidate_community(community_id)
 
     await redis.publish(
         f"community_deleted.{community_id}",
@@ -362,8 +376,37 @@ async def delete_community(
         )
     )
 
+    # Channels, members, messages and invites are purged in the background, in batches
+    CommunityPurger.schedule(community_id)
+
     return
 
+@app.get("/{community_id}/deletion")
+async def get_community_deletion_status(
+    user_id : Annotated[str, Depends(X_USER_HEADER)],
+    community_id : str
+) -> CommunityDeletionStatus:
+
+    db = await get_database()
+
+    job = await db.get_collection(DELETIONS_COLLECTION).find_one(
+        {"_id" : ObjectId(community_id), "deleted_by" : ObjectId(user_id)}
+    )
+
+    if not job:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Failed to find community deletion",
+            identifier="community_deletion_not_found"
+        )
+
+    return CommunityDeletionStatus(
+        community_id=community_id,
+        deleted_at=job["deleted_at"],
+        purged=job["purged"],
+        completed_at=job["completed_at"]
+    )
+
 # ------------------------------------------------
 # Below just includes all of the subrouters
 
@@ -0,0 +1,425 @@
+import asyncio
+from collections import OrderedDict
+import logging
+from time import monotonic
+from typing import Callable, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+from bson import ObjectId
+from fastapi import FastAPI
+from redis.exceptions import RedisError
+
+from delve_common._db._database import get_database
+from delve_common._db._redis import get_redis
+from delve_common._types._dtos._communities import Community
+
+from .constants import (
+    COMMUNITY_CACHE_SIZE,
+    JOINED_COMMUNITIES_CACHE_SIZE,
+    CACHE_JOINED_COMMUNITIES,
+    ROLE_MEMBERS_CACHE_SIZE,
+    INVITE_CACHE_SIZE,
+    CHANNEL_LIST_CACHE_SIZE,
+    CHANNEL_SETTINGS_CACHE_SIZE,
+    CACHE_TTL_SECONDS,
+    CACHE_INVALIDATOR_RETRY_SECONDS
+)
+from .converters import community_converter
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+class LRUCache(Generic[K, V]):
+    """
+        A small, per-worker least-recently-used cache.
+        Entries expire after `ttl` seconds, as a backstop for any invalidation event that never arrives.
+    """
+
+    __entries : "OrderedDict[K, Tuple[V, float]]"
+    __maxsize : int
+    __ttl : Optional[float]
+
+    # Bumped on every invalidation, see `set`
+    generation : int
+
+    def __init__(self, maxsize : int, ttl : Optional[float] = None) -> None:
+        self.__entries = OrderedDict()
+        self.__maxsize = maxsize
+        self.__ttl = ttl
+        self.generation = 0
+
+    def get(self, key : K) -> Optional[V]:
+
+        entry = self.__entries.get(key)
+
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+
+        if expires_at < monotonic():
+            del self.__entries[key]
+            return None
+
+        self.__entries.move_to_end(key)
+        return value
+
+    def set(self, key : K, value : V, *, generation : Optional[int] = None) -> None:
+        """
+            Pass the `generation` read before fetching `value` to only store it if nothing was
+            invalidated in the meantime, otherwise an invalidation that raced the fetch would be undone.
+        """
+
+        if generation is not None and generation != self.generation:
+            return
+
+        expires_at = monotonic() + self.__ttl if self.__ttl is not None else float("inf")
+
+        self.__entries[key] = (value, expires_at)
+        self.__entries.move_to_end(key)
+
+        if len(self.__entries) > self.__maxsize:
+            self.__entries.popitem(last=False)
+
+    def pop(self, key : K) -> None:
+        self.generation += 1
+        self.__entries.pop(key, None)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.__entries.clear()
+
+# The field on a community document that is bumped on every mutation of the community
+COMMUNITY_VERSION_FIELD = "version"
+
+# (version, community) keyed by the community id
+community_cache : LRUCache[str, Tuple[int, Community]] = LRUCache(COMMUNITY_CACHE_SIZE, CACHE_TTL_SECONDS)
+
+def community_etag(community_id : str, version : int) -> str:
+    return f'"{community_id}.{version}"'
+
+async def get_community_snapshot(community_id : str) -> Optional[Tuple[int, Community]]:
+    """
+        Returns the `(version, community)` snapshot for a community, only going to mongo
+        when this worker doesn't already hold a copy. Returns `None` if the community doesn't exist.
+    """
+
+    snapshot = community_cache.get(community_id)
+
+    if snapshot is not None:
+        return snapshot
+
+    db = await get_database()
+    generation = community_cache.generation
+
+    res = await db.get_collection("communities").find_one({"_id" : ObjectId(community_id)})
+
+    if not res:
+        return None
+
+    snapshot = (res.get(COMMUNITY_VERSION_FIELD, 0), community_converter.load(res))
+    community_cache.set(community_id, snapshot, generation=generation)
+
+    return snapshot
+
+def invalidate_community(community_id : str) -> None:
+    community_cache.pop(str(community_id))
+
+async def get_community_snapshots(community_ids : List[str]) -> List[Tuple[int, Community]]:
+    """
+        Batch version of `get_community_snapshot`, fetching every uncached community with one `$in`.
+        Communities that don't exist are left out, otherwise the order of `community_ids` is kept.
+    """
+
+    snapshots = {c : community_cache.get(c) for c in community_ids}
+    missing = [ObjectId(c) for c, snapshot in snapshots.items() if snapshot is None]
+
+    if missing:
+        db = await get_database()
+        generation = community_cache.generation
+
+        async for res in db.get_collection("communities").find({"_id" : {"$in" : missing}}):
+            snapshot = (res.get(COMMUNITY_VERSION_FIELD, 0), community_converter.load(res))
+
+            snapshots[str(res["_id"])] = snapshot
+            community_cache.set(str(res["_id"]), snapshot, generation=generation)
+
+    return [snapshots[c] for c in community_ids if snapshots[c] is not None]
+
+# The ids of the communities a user has joined, keyed by the user id
+joined_communities_cache : LRUCache[str, List[str]] = LRUCache(JOINED_COMMUNITIES_CACHE_SIZE, CACHE_TTL_SECONDS)
+
+async def get_joined_community_ids(user_id : str) -> List[str]:
+
+    if CACHE_JOINED_COMMUNITIES:
+        community_ids = joined_communities_cache.get(user_id)
+
+        if community_ids is not None:
+            return community_ids
+
+    db = await get_database()
+    generation = joined_communities_cache.generation
+
+    # This is served by the `members.user_id` index
+    cur = db.get_collection("members").find(
+        {"user_id" : ObjectId(user_id)},
+        {"community_id" : 1, "_id" : 0}
+    )
+
+    community_ids = [str(m["community_id"]) async for m in cur]
+
+    if CACHE_JOINED_COMMUNITIES:
+        joined_communities_cache.set(user_id, community_ids, generation=generation)
+
+    return community_ids
+
+def invalidate_joined_communities(user_id : str) -> None:
+    joined_communities_cache.pop(str(user_id))
+
+# Which members hold each role, as `{role_id : [user_id, ...]}` keyed by the community id.
+# Any member or role change in a community drops that community's whole entry.
+role_members_cache : LRUCache[str, Dict[str, List[str]]] = LRUCache(ROLE_MEMBERS_CACHE_SIZE, CACHE_TTL_SECONDS)
+
+async def get_role_members(community_id : str, role_ids : List[str]) -> Dict[str, List[str]]:
+    """
+        Returns `{role_id : [user_id, ...]}` for each of the given roles in the community.
+        Every role that isn't cached yet is read in the same query.
+    """
+
+    roles = role_members_cache.get(community_id) or {}
+
+    found = {r : roles[r] for r in role_ids if r in roles}
+    missing = [r for r in dict.fromkeys(role_ids) if r not in found]
+
+    if not missing:
+        return found
+
+    db = await get_database()
+    generation = role_members_cache.generation
+
+    # Served by the members (community_id, role_ids) index
+    cur = db.get_collection("members").find(
+        {"community_id" : ObjectId(community_id), "role_ids" : {"$in" : [ObjectId(r) for r in missing]}},
+        {"user_id" : 1, "role_ids" : 1, "_id" : 0}
+    )
+
+    fetched = {r : [] for r in missing}
+
+    async for m in cur:
+        for role_id in m.get("role_ids", []):
+            if str(role_id) in fetched:
+                fetched[str(role_id)].append(str(m["user_id"]))
+
+    # Only kept if nothing was invalidated while the members were being read
+    if generation == role_members_cache.generation:
+        roles = role_members_cache.get(community_id)
+
+        if roles is None:
+            roles = {}
+            role_members_cache.set(community_id, roles)
+
+        roles.update(fetched)
+
+    return {**found, **fetched}
+
+def invalidate_role_members(community_id : str) -> None:
+    role_members_cache.pop(str(community_id))
+
+# Raw invite documents keyed by the invite code. Deleting an invite evicts it everywhere,
+# expiry is checked against the cached `expires_at` and a deleted community fails the snapshot lookup.
+invite_cache : LRUCache[str, dict] = LRUCache(INVITE_CACHE_SIZE, CACHE_TTL_SECONDS)
+
+async def get_invite(invite_code : str) -> Optional[dict]:
+
+    invite = invite_cache.get(invite_code)
+
+    if invite is not None:
+        return invite
+
+    db = await get_database()
+    generation = invite_cache.generation
+
+    invite = await db.get_collection("invites").find_one({"invite_code" : invite_code})
+
+    # Misses aren't cached, a code that doesn't exist yet may be created at any time
+    if invite:
+        invite_cache.set(invite_code, invite, generation=generation)
+
+    return invite
+
+def invalidate_invite(invite_code : str) -> None:
+    invite_cache.pop(invite_code)
+
+# A community's channel list, already encoded as the JSON response body and keyed by the community id.
+# Any channel event for the community drops it.
+channel_list_cache : LRUCache[str, bytes] = LRUCache(CHANNEL_LIST_CACHE_SIZE, CACHE_TTL_SECONDS)
+
+def invalidate_channel_list(community_id : str) -> None:
+    channel_list_cache.pop(str(community_id))
+
+# Each channel's slow mode interval in seconds (0 when off), keyed by the channel id
+channel_slowmode_cache : LRUCache[str, int] = LRUCache(CHANNEL_SETTINGS_CACHE_SIZE, CACHE_TTL_SECONDS)
+
+async def get_channel_slowmode(community_id : str, channel_id : str) -> Optional[int]:
+    """Returns the channel's slow mode interval, or `None` if the channel doesn't exist in the community"""
+
+    slowmode = channel_slowmode_cache.get(channel_id)
+
+    if slowmode is not None:
+        return slowmode
+
+    db = await get_database()
+    generation = channel_slowmode_cache.generation
+
+    channel = await db.get_collection("channels").find_one(
+        {"community_id" : ObjectId(community_id), "_id" : ObjectId(channel_id)},
+        {"slowmode_seconds" : 1}
+    )
+
+    if not channel:
+        return None
+
+    slowmode = channel.get("slowmode_seconds", 0)
+    channel_slowmode_cache.set(channel_id, slowmode, generation=generation)
+
+    return slowmode
+
+def invalidate_channel_settings(channel_id : str) -> None:
+    channel_slowmode_cache.pop(str(channel_id))
+
+def clear_caches() -> None:
+    """Drops everything this worker has cached"""
+
+    for cache in (
+        community_cache,
+        joined_communities_cache,
+        role_members_cache,
+        invite_cache,
+        channel_list_cache,
+        channel_slowmode_cache
+    ):
+        cache.clear()
+
+class CacheInvalidator(object):
+    """
+        Listens to the community events published by every worker and evicts the
+        matching snapshots from this worker's caches.
+    """
+
+    # Maps the event prefix of a redis channel to what it invalidates,
+    # the handlers are given the rest of the dot-separated channel name
+    handlers : Dict[str, List[Callable[..., None]]] = {
+        "community_modified" : [lambda community_id, *_: invalidate_community(community_id)],
+        "community_deleted" : [
+            lambda community_id, *_: invalidate_community(community_id),
+            lambda community_id, *_: invalidate_role_members(community_id),
+            lambda community_id, *_: invalidate_channel_list(community_id)
+        ],
+        # Creating or deleting a channel also changes the community's `channel_ids`
+        "channel_created" : [
+            lambda community_id, *_: invalidate_community(community_id),
+            lambda community_id, *_: invalidate_channel_list(community_id)
+        ],
+        "channel_modified" : [
+            lambda community_id, *_: invalidate_channel_list(community_id),
+            lambda community_id, channel_id: invalidate_channel_settings(channel_id)
+        ],
+        "channel_deleted" : [
+            lambda community_id, *_: invalidate_community(community_id),
+            lambda community_id, *_: invalidate_channel_list(community_id),
+            lambda community_id, channel_id: invalidate_channel_settings(channel_id)
+        ],
+        "role_created" : [lambda community_id, *_: invalidate_community(community_id)],
+        "role_modified" : [lambda community_id, *_: invalidate_community(community_id)],
+        "role_deleted" : [
+            lambda community_id, *_: invalidate_community(community_id),
+            lambda community_id, *_: invalidate_role_members(community_id)
+        ],
+        "role_reorder" : [lambda community_id, *_: invalidate_community(community_id)],
+        "member_joined" : [lambda community_id, user_id: invalidate_joined_communities(user_id)],
+        "member_left" : [
+            lambda community_id, user_id: invalidate_joined_communities(user_id),
+            lambda community_id, user_id: invalidate_role_members(community_id)
+        ],
+        "member_modified" : [lambda community_id, *_: invalidate_role_members(community_id)],
+        "invite_deleted" : [lambda community_id, invite_code: invalidate_invite(invite_code)],
+    }
+
+    @classmethod
+    async def listen(cls) -> None:
+
+        redis = await get_redis()
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+
+        await pubsub.connect()
+        await pubsub.psubscribe(*[f"{prefix}.*" for prefix in cls.handlers])
+
+        # Anything cached before this point may have missed its invalidation while we weren't subscribed
+        clear_caches()
+
+        while True:
+            msg = await pubsub.get_message(timeout=60)
+            if msg is None: continue
+
+            channel = msg["channel"]
+            if isinstance(channel, bytes): channel = channel.decode("utf-8")
+
+            # All community events are named `<event>.<community_id>[.<...>]`
+            prefix, *args = channel.split(".")
+
+            for handler in cls.handlers.get(prefix, []):
+                try:
+                    handler(*args)
+                except Exception:
+                    logger.exception("Cache invalidation failed for %s", channel)
+
+    @classmethod
+    async def run(cls) -> None:
+
+        # Resubscribes after losing the connection, the cache TTLs cover the gap in the meantime
+        while True:
+            try:
+                await cls.listen()
+            except (RedisError, OSError):
+                logger.exception("Cache invalidator lost its redis connection, reconnecting")
+                clear_caches()
+
+                await asyncio.sleep(CACHE_INVALIDATOR_RETRY_SECONDS)
+
+    @classmethod
+    def using_app(cls, app : FastAPI) -> None:
+
+        @app.on_event("startup")
+        async def start_cache_invalidator() -> None:
+            app.state.cache_invalidator = asyncio.create_task(cls.run())
+
+        @app.on_event("shutdown")
+        async def stop_cache_invalidator() -> None:
+            app.state.cache_invalidator.cancel()
+
+__all__ = [
+    LRUCache,
+    COMMUNITY_VERSION_FIELD,
+    community_cache,
+    community_etag,
+    get_community_snapshot,
+    invalidate_community,
+    get_community_snapshots,
+    joined_communities_cache,
+    get_joined_community_ids,
+    invalidate_joined_communities,
+    role_members_cache,
+    get_role_members,
+    invalidate_role_members,
+    invite_cache,
+    get_invite,
+    invalidate_invite,
+    channel_list_cache,
+    invalidate_channel_list,
+    channel_slowmode_cache,
+    get_channel_slowmode,
+    invalidate_channel_settings,
+    clear_caches,
+    CacheInvalidator
+]
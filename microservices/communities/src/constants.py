@@ -1,7 +1,121 @@
 from fastapi.security import APIKeyHeader
+from os import getenv
 
 X_USER_HEADER = APIKeyHeader(name="X-UserInfo")
 
+# Member list pagination
+MEMBER_PAGE_SIZE = 50
+MAX_MEMBER_PAGE_SIZE = 200
+
+# The most users that can be resolved in one batch member lookup
+MAX_MEMBER_BATCH_SIZE = 500
+
+# How many community snapshots each worker keeps in memory
+COMMUNITY_CACHE_SIZE = 1024
+
+# Every in-process cache entry expires after this long, in case its invalidation event is lost
+CACHE_TTL_SECONDS = 30
+
+# How long the cache invalidator waits before resubscribing after losing redis
+CACHE_INVALIDATOR_RETRY_SECONDS = 1
+
+# Per-user joined community lists, these are invalidated by member join/leave events
+CACHE_JOINED_COMMUNITIES = getenv("CACHE_JOINED_COMMUNITIES", "true").lower() == "true"
+JOINED_COMMUNITIES_CACHE_SIZE = 4096
+
+# How many messages are pulled from mongo per round trip when exporting a channel
+EXPORT_BATCH_SIZE = 5000
+
+# The most messages that can be created in one bulk request
+MAX_BULK_MESSAGES = 1000
+
+# How many communities' role -> members lists each worker keeps for role mentions
+ROLE_MEMBERS_CACHE_SIZE = 1024
+
+# Invite codes are random letters, the unique index on `invite_code` catches the (rare) collisions.
+# 52^6 codes leaves a collision chance of ~0.05% per attempt even at 10M live invites.
+INVITE_CODE_LENGTH = 6
+INVITE_CODE_ATTEMPTS = 5
+
+# How many invite codes each worker keeps resolved in memory, so a viral invite doesn't send every join to mongo
+INVITE_CACHE_SIZE = 4096
+
+# How many joins a single invite code admits per window, across all workers
+INVITE_JOIN_RATE_LIMIT = 100
+INVITE_JOIN_RATE_WINDOW_SECONDS = 1
+
+# Member joins are coalesced into one `members_joined` event per community per flush
+MEMBER_JOIN_FLUSH_SECONDS = 0.5
+MAX_MEMBERS_JOINED_BATCH = 100
+
+# How often the per-invite usage counters are moved from redis into mongo
+INVITE_USAGE_FLUSH_SECONDS = 10
+
+# Deleted communities are purged in the background, this many documents per batch
+PURGE_BATCH_SIZE = 1000
+PURGE_BATCH_PAUSE_SECONDS = 0.05
+
+# How long a worker holds a purge job before another worker may take it over
+PURGE_LEASE_SECONDS = 60
+
+# How many times a role reorder is retried when the community changes underneath it
+ROLE_REORDER_ATTEMPTS = 3
+
+# How many communities' encoded channel lists each worker keeps, opening a community reads it
+CHANNEL_LIST_CACHE_SIZE = 2048
+
+# Counter on the community document that hands out the position of each new channel
+CHANNEL_POSITION_SEQ_FIELD = "channel_position_seq"
+
+# Per-user message rate limit, a burst of this many messages refilled over the window
+MESSAGE_RATE_BURST = 5
+MESSAGE_RATE_WINDOW_SECONDS = 5
+
+# Bulk message requests get their own, smaller budget of whole batches
+BULK_MESSAGE_RATE_BURST = 2
+BULK_MESSAGE_RATE_WINDOW_SECONDS = 10
+
+# Per-channel slow mode, the longest a channel can make each user wait between messages
+MAX_SLOWMODE_SECONDS = 6 * 60 * 60
+
+# How many channels' settings (eg. slow mode) each worker keeps in memory
+CHANNEL_SETTINGS_CACHE_SIZE = 8192
+
+# How many rate limited (user, channel) pairs each worker remembers, to reject repeats without asking redis
+RATE_LIMIT_LOCAL_CACHE_SIZE = 16384
+
 __all__ = [
-    X_USER_HEADER
-]
\ No newline at end of file
+    X_USER_HEADER,
+    MEMBER_PAGE_SIZE,
+    MAX_MEMBER_PAGE_SIZE,
+    MAX_MEMBER_BATCH_SIZE,
+    COMMUNITY_CACHE_SIZE,
+    CACHE_TTL_SECONDS,
+    CACHE_INVALIDATOR_RETRY_SECONDS,
+    CACHE_JOINED_COMMUNITIES,
+    JOINED_COMMUNITIES_CACHE_SIZE,
+    EXPORT_BATCH_SIZE,
+    MAX_BULK_MESSAGES,
+    ROLE_MEMBERS_CACHE_SIZE,
+    INVITE_CODE_LENGTH,
+    INVITE_CODE_ATTEMPTS,
+    INVITE_CACHE_SIZE,
+    INVITE_JOIN_RATE_LIMIT,
+    INVITE_JOIN_RATE_WINDOW_SECONDS,
+    MEMBER_JOIN_FLUSH_SECONDS,
+    MAX_MEMBERS_JOINED_BATCH,
+    INVITE_USAGE_FLUSH_SECONDS,
+    PURGE_BATCH_SIZE,
+    PURGE_BATCH_PAUSE_SECONDS,
+    PURGE_LEASE_SECONDS,
+    ROLE_REORDER_ATTEMPTS,
+    CHANNEL_LIST_CACHE_SIZE,
+    CHANNEL_POSITION_SEQ_FIELD,
+    MESSAGE_RATE_BURST,
+    MESSAGE_RATE_WINDOW_SECONDS,
+    BULK_MESSAGE_RATE_BURST,
+    BULK_MESSAGE_RATE_WINDOW_SECONDS,
+    MAX_SLOWMODE_SECONDS,
+    CHANNEL_SETTINGS_CACHE_SIZE,
+    RATE_LIMIT_LOCAL_CACHE_SIZE
+]
@@ -0,0 +1,193 @@
+from typing import Any, Callable, Dict, Generic, List, Tuple, Type, TypeVar, Union, get_args, get_origin
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel
+from pydantic.fields import FieldInfo
+
+from delve_common._types._dtos._communities._channel import Channel
+from delve_common._types._dtos._communities._community import Community
+from delve_common._types._dtos._communities._invite import Invite
+from delve_common._types._dtos._communities._member import Member
+from delve_common._types._dtos._communities._role import Role
+from delve_common._types._dtos._message import Message
+from delve_common._types._dtos._user import User
+
+M = TypeVar("M", bound=BaseModel)
+
+def _to_oid(v : Any) -> Any:
+    if v is None or isinstance(v, ObjectId):
+        return v
+
+    try:
+        return ObjectId(v)
+    except (InvalidId, TypeError):
+        return v
+
+def _to_str(v : Any) -> Any:
+    return str(v) if isinstance(v, ObjectId) else v
+
+def _unwrap_annotation(annotation : Any) -> Tuple[Any, bool]:
+    """Strips `Optional`/`Union[..., None]` and returns `(inner type, is_list)`"""
+
+    while get_origin(annotation) is Union:
+        args = [a for a in get_args(annotation) if a is not type(None)]
+
+        if len(args) != 1:
+            return annotation, False
+
+        annotation = args[0]
+
+    if get_origin(annotation) in (list, List):
+        return _unwrap_annotation(get_args(annotation)[0])[0], True
+
+    return annotation, False
+
+class DocumentConverter(Generic[M]):
+    """
+        A schema-driven replacement for `objectid_fix`, built once per dto.
+        The dto's fields are inspected up front, so converting a document is a single pass
+        over just the fields that hold ObjectIds, instead of a recursive walk over every key.
+    """
+
+    model : Type[M]
+
+    # The field names that hold a single ObjectId / a list of ObjectIds
+    id_fields : Tuple[str, ...]
+    id_list_fields : Tuple[str, ...]
+
+    # Fields holding other dtos that themselves contain ObjectIds
+    nested_fields : Tuple[Tuple[str, "DocumentConverter", bool], ...]
+
+    # Every dto field as `(name, key in the document, field)`, and a find/$project spec for just those keys.
+    # Anything else stored on a document (counters, internal bookkeeping) stays out of raw responses
+    fields : Tuple[Tuple[str, str, FieldInfo], ...]
+    projection : Dict[str, int]
+
+    def __init__(self, model : Type[M]) -> None:
+
+        self.model = model
+
+        self.fields = tuple(
+            (name, "_id" if name == "id" else name, field)
+            for name, field in model.model_fields.items()
+        )
+        self.projection = {key : 1 for _, key, _ in self.fields}
+
+        id_fields, id_list_fields, nested_fields = [], [], []
+
+        for name, field in model.model_fields.items():
+
+            if name == "id":
+                continue
+
+            inner, is_list = _unwrap_annotation(field.annotation)
+
+            if name.endswith("_id"):
+                id_fields.append(name)
+
+            elif name.endswith("_ids"):
+                id_list_fields.append(name)
+
+            elif isinstance(inner, type) and issubclass(inner, BaseModel):
+                nested = DocumentConverter(inner)
+
+                if nested.has_ids:
+                    nested_fields.append((name, nested, is_list))
+
+        self.id_fields = tuple(id_fields)
+        self.id_list_fields = tuple(id_list_fields)
+        self.nested_fields = tuple(nested_fields)
+
+    @property
+    def has_ids(self) -> bool:
+        return "id" in self.model.model_fields or bool(self.id_fields or self.id_list_fields or self.nested_fields)
+
+    def __convert(
+        self,
+        d : dict,
+        from_key : str,
+        to_key : str,
+        f : Callable[[Any], Any],
+        nested : Callable[["DocumentConverter", dict], dict]
+    ) -> dict:
+
+        out = dict(d)
+
+        if from_key in out:
+            out[to_key] = f(out.pop(from_key))
+
+        for k in self.id_fields:
+            if k in out:
+                out[k] = f(out[k])
+
+        for k in self.id_list_fields:
+            if out.get(k):
+                out[k] = [f(v) for v in out[k]]
+
+        for k, converter, is_list in self.nested_fields:
+            v = out.get(k)
+
+            if not v:
+                continue
+
+            if is_list:
+                out[k] = [nested(converter, vi) if isinstance(vi, dict) else vi for vi in v]
+
+            elif isinstance(v, dict):
+                out[k] = nested(converter, v)
+
+        return out
+
+    def to_mongo(self, d : dict) -> dict:
+        """`id` -> `_id`, and every id field as an ObjectId"""
+        return self.__convert(d, "id", "_id", _to_oid, DocumentConverter.to_mongo)
+
+    def from_mongo(self, d : dict) -> dict:
+        """`_id` -> `id`, and every id field as a string"""
+        return self.__convert(d, "_id", "id", _to_str, DocumentConverter.from_mongo)
+
+    def shape(self, d : dict) -> dict:
+        """
+            The document as the dto would dump it, for the raw response path. Only the dto's fields
+            (with `_id` as `id`) are kept, and a field the document doesn't have gets the dto's default.
+            Values are left as they came from mongo, ObjectIds are for the encoder to turn into strings.
+        """
+
+        out = {}
+
+        for name, key, field in self.fields:
+
+            if key in d:
+                out[name] = d[key]
+
+            elif not field.is_required():
+                default = field.get_default(call_default_factory=True)
+                out[name] = default.model_dump(mode="json") if isinstance(default, BaseModel) else default
+
+        return out
+
+    def load(self, d : dict) -> M:
+        return self.model(**self.from_mongo(d))
+
+    def dump(self, m : M) -> dict:
+        return self.to_mongo(m.model_dump())
+
+channel_converter : DocumentConverter[Channel] = DocumentConverter(Channel)
+community_converter : DocumentConverter[Community] = DocumentConverter(Community)
+invite_converter : DocumentConverter[Invite] = DocumentConverter(Invite)
+member_converter : DocumentConverter[Member] = DocumentConverter(Member)
+message_converter : DocumentConverter[Message] = DocumentConverter(Message)
+role_converter : DocumentConverter[Role] = DocumentConverter(Role)
+user_converter : DocumentConverter[User] = DocumentConverter(User)
+
+__all__ = [
+    DocumentConverter,
+    channel_converter,
+    community_converter,
+    invite_converter,
+    member_converter,
+    message_converter,
+    role_converter,
+    user_converter
+]
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+from datetime import UTC, datetime, timedelta
+from typing import List, Optional
+
+from bson import ObjectId
+from fastapi import FastAPI
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from delve_common._db._database import get_database
+from delve_common._db._redis import get_redis
+
+from .constants import PURGE_BATCH_SIZE, PURGE_BATCH_PAUSE_SECONDS, PURGE_LEASE_SECONDS
+from .read_state import channel_seq_key
+
+logger = logging.getLogger(__name__)
+
+# Tombstones for deleted communities, which double as the progress record of their purge jobs
+DELETIONS_COLLECTION = "community_deletions"
+
+# The order children are purged in, smallest and most access-relevant first
+PURGE_ORDER : List[str] = [
+    "members",
+    "invites",
+    "channels",
+    "message_edits",
+    "community_messages",
+]
+
+async def create_tombstone(community_id : str, deleted_by : str) -> bool:
+    """
+        Records the deletion of a community, returns `False` if it was already deleted.
+        This is written before the community document itself is removed, so a crash in between
+        leaves a job that `resume_purges` picks up rather than orphaned children.
+    """
+
+    db = await get_database()
+
+    try:
+        await db.get_collection(DELETIONS_COLLECTION).insert_one({
+            "_id" : ObjectId(community_id),
+            "deleted_by" : ObjectId(deleted_by),
+            "deleted_at" : datetime.now(tz=UTC),
+            "purged" : {c : 0 for c in PURGE_ORDER},
+            "completed_at" : None
+        })
+    except DuplicateKeyError:
+        return False
+
+    return True
+
+async def _claim(community_id : ObjectId) -> Optional[dict]:
+    """Leases a purge job to this worker, so only one worker purges a community at a time"""
+
+    db = await get_database()
+    now = datetime.now(tz=UTC)
+
+    return await db.get_collection(DELETIONS_COLLECTION).find_one_and_update(
+        {
+            "_id" : community_id,
+            "completed_at" : None,
+            "$or" : [{"lease_until" : None}, {"lease_until" : {"$lt" : now}}]
+        },
+        {"$set" : {"lease_until" : now + timedelta(seconds=PURGE_LEASE_SECONDS)}},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def purge_community(community_id : str) -> None:
+    """
+        Deletes everything that belongs to a tombstoned community, in batches of `PURGE_BATCH_SIZE`.
+        Every batch is idempotent and progress is recorded as it goes, so the job can be resumed
+        from anywhere (by any worker) after a crash or restart.
+    """
+
+    db = await get_database()
+    redis = await get_redis()
+
+    oid = ObjectId(community_id)
+
+    if not await _claim(oid):
+        return
+
+    jobs = db.get_collection(DELETIONS_COLLECTION)
+
+    # Harmless if it's already gone, this covers a crash between the tombstone and the delete
+    await db.get_collection("communities").delete_one({"_id" : oid})
+
+    for collection in PURGE_ORDER:
+        while True:
+
+            # Each batch is served by the collection's community_id index
+            ids = [
+                d["_id"] async for d in
+                db.get_collection(collection).find({"community_id" : oid}, {"_id" : 1}).limit(PURGE_BATCH_SIZE)
+            ]
+
+            if not ids:
+                break
+
+            if collection == "channels":
+                await redis.delete(*[channel_seq_key(str(i)) for i in ids])
+
+            res = await db.get_collection(collection).delete_many({"_id" : {"$in" : ids}})
+
+            # Records progress and renews the lease in the same write
+            await jobs.update_one(
+                {"_id" : oid},
+                {
+                    "$inc" : {f"purged.{collection}" : res.deleted_count},
+                    "$set" : {"lease_until" : datetime.now(tz=UTC) + timedelta(seconds=PURGE_LEASE_SECONDS)}
+                }
+            )
+
+            # Leaves room for the requests this worker is serving, and for the database
+            await asyncio.sleep(PURGE_BATCH_PAUSE_SECONDS)
+
+    await jobs.update_one(
+        {"_id" : oid},
+        {"$set" : {"completed_at" : datetime.now(tz=UTC), "lease_until" : None}}
+    )
+
+async def _purge_logged(community_id : str) -> None:
+    """Runs a purge job, logging rather than raising if it fails. The job is retried once its lease runs out"""
+
+    try:
+        await purge_community(community_id)
+    except Exception:
+        logger.exception("Purge of community %s failed, it will be retried", community_id)
+
+async def resume_purges() -> None:
+    """Picks up every purge job that hasn't finished, eg. after a restart"""
+
+    db = await get_database()
+
+    # Read up front, a long purge shouldn't hold the cursor open until it times out
+    jobs = await db.get_collection(DELETIONS_COLLECTION).find({"completed_at" : None}, {"_id" : 1}).to_list(None)
+
+    # One failing job doesn't hold up the rest
+    for job in jobs:
+        await _purge_logged(str(job["_id"]))
+
+class CommunityPurger(object):
+    """Runs community purges in the background of the worker, away from the request that asked for them"""
+
+    tasks : "set[asyncio.Task]" = set()
+
+    @classmethod
+    def schedule(cls, community_id : str) -> None:
+
+        task = asyncio.create_task(_purge_logged(community_id))
+
+        # Keeps a reference to the task until it's done, so it isn't garbage collected mid purge
+        cls.tasks.add(task)
+        task.add_done_callback(cls.tasks.discard)
+
+    @classmethod
+    async def run(cls) -> None:
+
+        # Also takes over the jobs of workers that went away mid purge, once their lease runs out
+        while True:
+            try:
+                await resume_purges()
+            except Exception:
+                logger.exception("Failed to resume community purges, retrying")
+
+            await asyncio.sleep(PURGE_LEASE_SECONDS)
+
+    @classmethod
+    def using_app(cls, app : FastAPI) -> None:
+
+        @app.on_event("startup")
+        async def resume_community_purges() -> None:
+            task = asyncio.create_task(cls.run())
+            cls.tasks.add(task)
+            task.add_done_callback(cls.tasks.discard)
+
+        @app.on_event("shutdown")
+        async def stop_community_purges() -> None:
+            # Unfinished jobs are resumed once their lease runs out
+            for task in cls.tasks:
+                task.cancel()
+
+__all__ = [
+    DELETIONS_COLLECTION,
+    PURGE_ORDER,
+    create_tombstone,
+    purge_community,
+    resume_purges,
+    CommunityPurger
+]
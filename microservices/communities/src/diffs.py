@@ -0,0 +1,46 @@
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Tuple
+
+from pydantic import BaseModel
+
+# A diff is a list of `(start, end, replacement)` edits against the source string,
+# where `source[start:end]` gets replaced with `replacement`. Unchanged spans aren't stored.
+TextDiff = List[Tuple[int, int, str]]
+
+def text_diff(a : str, b : str) -> TextDiff:
+    """Returns the compact diff that turns `a` into `b`"""
+
+    return [
+        (i1, i2, b[j1:j2])
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+        if tag != "equal"
+    ]
+
+def apply_text_diff(a : str, diff : TextDiff) -> str:
+
+    out = []
+    pos = 0
+
+    for start, end, replacement in diff:
+        out.append(a[pos:start])
+        out.append(replacement)
+        pos = end
+
+    out.append(a[pos:])
+
+    return "".join(out)
+
+def model_delta(before : BaseModel, after : BaseModel) -> Dict[str, Any]:
+    """Returns `{field : new value}` for every top-level field that differs between two versions of a dto"""
+
+    b = before.model_dump(mode="json")
+    a = after.model_dump(mode="json")
+
+    return {k : v for k, v in a.items() if b.get(k) != v}
+
+__all__ = [
+    TextDiff,
+    text_diff,
+    apply_text_diff,
+    model_delta
+]
@@ -0,0 +1,100 @@
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Optional
+
+from delve_common._messages.base import BaseEvent
+from delve_common._types._dtos._communities._member import Member
+
+from .diffs import TextDiff
+
+class CommunityMessageEditedEvent(BaseEvent):
+    """
+        A slimmer replacement for `CommunityMessageModifiedEvent` that carries the text diff
+        for the edit instead of two full copies of the message.
+    """
+    event : Literal["community_message_modified"] = "community_message_modified"
+
+    community_id : str
+    channel_id : str
+    message_id : str
+
+    # The revision this edit produced, the original message is revision 0
+    revision : int
+
+    # Turns the text of revision `revision - 1` into the text of `revision`
+    diff : TextDiff
+
+    mentions : List[str]
+    edited_at : Optional[datetime]
+
+# The member equivalent of `COMMUNITY_VERSION_FIELD`, bumped on every member edit
+MEMBER_VERSION_FIELD = "version"
+
+# Channel suffix carrying the old full `before`/`after` events, for clients that opt into them
+FULL_EVENT_SUFFIX = "_full"
+
+def full_event_channel(channel : str) -> str:
+    """`community_modified.<id>` -> `community_modified_full.<id>`"""
+
+    prefix, _, rest = channel.partition(".")
+    return f"{prefix}{FULL_EVENT_SUFFIX}.{rest}"
+
+# The delta events only carry the fields that changed, along with a version that lets clients
+# notice a missed event (and refetch) rather than silently drifting out of sync.
+
+class CommunityDeltaEvent(BaseEvent):
+    event : Literal["community_modified"] = "community_modified"
+
+    community_id : str
+
+    # The community's version after this change
+    version : int
+    changes : Dict[str, Any]
+
+class MemberDeltaEvent(BaseEvent):
+    event : Literal["member_modified"] = "member_modified"
+
+    community_id : str
+    user_id : str
+
+    # The member's version after this change
+    version : int
+    changes : Dict[str, Any]
+
+class RoleDeltaEvent(BaseEvent):
+    event : Literal["role_modified"] = "role_modified"
+
+    community_id : str
+    role_id : str
+
+    # The community's roles version after this change
+    version : int
+    changes : Dict[str, Any]
+
+class MembersJoinedEvent(BaseEvent):
+    """
+        Every member that joined a community during one flush window, sent to the community's
+        subscribers in place of one `joined_community` frame per join.
+    """
+    event : Literal["members_joined"] = "members_joined"
+
+    community_id : str
+    members : List[Member]
+
+class InviteDeletedEvent(BaseEvent):
+    """Internal, lets every worker drop the invite from its invite cache"""
+    event : Literal["invite_deleted"] = "invite_deleted"
+
+    community_id : str
+    invite_code : str
+
+__all__ = [
+    CommunityMessageEditedEvent,
+    MEMBER_VERSION_FIELD,
+    FULL_EVENT_SUFFIX,
+    full_event_channel,
+    CommunityDeltaEvent,
+    MemberDeltaEvent,
+    RoleDeltaEvent,
+    MembersJoinedEvent,
+    InviteDeletedEvent
+]
@@ -0,0 +1,141 @@
+from os import getenv
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import FastAPI
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from delve_common._db._database import get_database
+
+# Every index that this service relies on, keyed by collection
+INDEXES : Dict[str, List[IndexModel]] = {
+    "members" : [
+        # Also guarantees that a user can only join a community once
+        IndexModel([("user_id", ASCENDING), ("community_id", ASCENDING)], unique=True, name="members_composite_index"),
+        IndexModel([("community_id", ASCENDING), ("_id", ASCENDING)], name="members_community_index"),
+        # Multikey on `role_ids`, answers "which members have role X" for role mentions and role member lists
+        IndexModel([("community_id", ASCENDING), ("role_ids", ASCENDING), ("_id", ASCENDING)], name="members_role_index"),
+    ],
+    "channels" : [
+        # Channel lists are read in position order, the id breaks ties between channels without a position
+        IndexModel([("community_id", ASCENDING), ("position", ASCENDING), ("_id", ASCENDING)], name="channels_position_index"),
+    ],
+    "community_messages" : [
+        IndexModel(
+            [("community_id", ASCENDING), ("channel_id", ASCENDING), ("created_at", DESCENDING)],
+            name="community_messages_channel_index"
+        ),
+        IndexModel(
+            [("community_id", ASCENDING), ("channel_id", ASCENDING), ("_id", ASCENDING)],
+            name="community_messages_export_index"
+        ),
+    ],
+    "message_edits" : [
+        IndexModel([("message_id", ASCENDING), ("revision", DESCENDING)], unique=True, name="message_edits_revision_index"),
+        IndexModel([("community_id", ASCENDING)], name="message_edits_community_index"),
+    ],
+    "community_deletions" : [
+        # Serves the unfinished job lookup, and drops finished jobs a week after they complete
+        IndexModel([("completed_at", ASCENDING)], expireAfterSeconds=7 * 24 * 60 * 60, name="community_deletions_completed_index"),
+    ],
+    "invites" : [
+        IndexModel([("invite_code", ASCENDING)], unique=True, name="invites_code_index"),
+        IndexModel([("community_id", ASCENDING)], name="invites_community_index"),
+        # TTL index, mongo removes each invite once its `expires_at` passes. Invites without one never expire
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="invites_expiry_index"),
+    ],
+}
+
+# (collection, filter, sort) for every query shape used in `src`, checked by `verify_query_plans`
+QUERY_SHAPES : List[Tuple[str, dict, Optional[List[Tuple[str, int]]]]] = [
+    ("members", {"user_id" : ObjectId()}, None),
+    ("members", {"user_id" : ObjectId(), "community_id" : ObjectId()}, None),
+    ("members", {"community_id" : ObjectId(), "user_id" : {"$in" : [ObjectId()]}}, None),
+    ("members", {"community_id" : ObjectId(), "_id" : {"$gt" : ObjectId()}}, [("_id", ASCENDING)]),
+    ("members", {"community_id" : ObjectId(), "role_ids" : ObjectId()}, None),
+    ("members", {"community_id" : ObjectId(), "role_ids" : ObjectId(), "_id" : {"$gt" : ObjectId()}}, [("_id", ASCENDING)]),
+    ("channels", {"community_id" : ObjectId()}, [("position", ASCENDING), ("_id", ASCENDING)]),
+    ("channels", {"community_id" : {"$in" : [ObjectId()]}}, None),
+    ("channels", {"community_id" : ObjectId(), "_id" : ObjectId()}, None),
+    ("community_messages", {"community_id" : ObjectId(), "channel_id" : ObjectId()}, [("created_at", DESCENDING)]),
+    ("community_messages", {"_id" : ObjectId(), "community_id" : ObjectId(), "channel_id" : ObjectId()}, None),
+    ("community_messages", {"community_id" : ObjectId(), "channel_id" : ObjectId(), "_id" : {"$gt" : ObjectId()}}, [("_id", ASCENDING)]),
+    ("message_edits", {"message_id" : ObjectId(), "revision" : {"$gt" : 0}}, [("revision", DESCENDING)]),
+    ("message_edits", {"message_id" : ObjectId()}, None),
+    ("message_edits", {"community_id" : ObjectId()}, None),
+    ("community_messages", {"community_id" : ObjectId()}, None),
+    ("members", {"community_id" : ObjectId()}, None),
+    ("community_deletions", {"completed_at" : None}, None),
+    ("invites", {"invite_code" : "aaaaaa"}, None),
+    ("invites", {"invite_code" : "aaaaaa", "community_id" : ObjectId()}, None),
+    ("invites", {"community_id" : ObjectId()}, None),
+    ("communities", {"_id" : {"$in" : [ObjectId()]}}, None),
+    ("users", {"_id" : {"$in" : [ObjectId()]}}, None),
+]
+
+class QueryPlanError(Exception):
+    pass
+
+async def apply_indexes() -> None:
+
+    db = await get_database()
+
+    for collection, indexes in INDEXES.items():
+        await db.get_collection(collection).create_indexes(indexes)
+
+def find_collscans(plan : dict) -> List[dict]:
+    """Walks an explain() plan tree and returns every COLLSCAN stage in it"""
+
+    found = [plan] if plan.get("stage") == "COLLSCAN" else []
+
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            found.extend(find_collscans(plan[key]))
+
+    for child in plan.get("inputStages", []):
+        found.extend(find_collscans(child))
+
+    return found
+
+async def verify_query_plans() -> None:
+    """Explains every registered query shape, raising `QueryPlanError` if any of them scan a whole collection"""
+
+    db = await get_database()
+
+    failures = []
+
+    for collection, query, sort in QUERY_SHAPES:
+        cur = db.get_collection(collection).find(query)
+
+        if sort:
+            cur = cur.sort(sort)
+
+        explanation = await cur.explain()
+
+        if find_collscans(explanation["queryPlanner"]["winningPlan"]):
+            failures.append((collection, query))
+
+    if failures:
+        raise QueryPlanError(f"Queries falling back to COLLSCAN: {failures}")
+
+class Indexes(object):
+
+    @classmethod
+    def using_app(cls, app : FastAPI) -> None:
+
+        @app.on_event("startup")
+        async def bootstrap_indexes() -> None:
+            await apply_indexes()
+
+            # Check mode, intended for CI and staging rather than every pod start
+            if getenv("VERIFY_QUERY_PLANS", "false").lower() == "true":
+                await verify_query_plans()
+
+__all__ = [
+    INDEXES,
+    QUERY_SHAPES,
+    QueryPlanError,
+    apply_indexes,
+    verify_query_plans,
+    Indexes
+]
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import UTC, datetime
+from typing import TYPE_CHECKING, Dict
+
+from bson import ObjectId
+from fastapi import FastAPI
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
+
+from delve_common._db._database import get_database
+from delve_common._db._redis import get_redis
+
+from .constants import INVITE_USAGE_FLUSH_SECONDS
+
+# Only for annotations, motor comes in through delve_common rather than being a dependency of this service
+if TYPE_CHECKING:
+    from motor.motor_asyncio import AsyncIOMotorCollection
+
+logger = logging.getLogger(__name__)
+
+# Joins counted since the last flush, as a hash of `{"<invite_code>|<YYYY-MM-DD>" : count}`
+PENDING_INVITE_USES_KEY = "invite_uses_pending"
+
+# The counters a flush has taken but not yet written to mongo, kept until the write succeeds
+PROCESSING_INVITE_USES_KEY = "invite_uses_processing"
+
+# Held by whichever worker is flushing, so only one of them ever works on the processing counters
+INVITE_USAGE_FLUSH_LOCK_KEY = "invite_uses_flush_lock"
+
+def _decode(v) -> str:
+    return v.decode("utf-8") if isinstance(v, bytes) else v
+
+def _today() -> str:
+    return datetime.now(tz=UTC).strftime("%Y-%m-%d")
+
+def count_invite_use(pipe, invite_code : str) -> None:
+    """Queues a join against an invite's usage analytics onto a redis pipeline"""
+    pipe.hincrby(PENDING_INVITE_USES_KEY, f"{invite_code}|{_today()}", 1)
+
+async def claim_invite_use(invites : "AsyncIOMotorCollection", invite_id : ObjectId, max_uses : int) -> bool:
+    """
+        Claims one of a limited invite's uses with a single conditional write,
+        so concurrent joins can never push `uses` past `max_uses`. Returns whether a use was claimed.
+    """
+
+    claimed = await invites.update_one(
+        {"_id" : invite_id, "uses" : {"$lt" : max_uses}},
+        {"$inc" : {"uses" : 1}}
+    )
+
+    return claimed.modified_count == 1
+
+async def release_invite_use(invites : "AsyncIOMotorCollection", invite_id : ObjectId) -> None:
+    """Hands back a use claimed by `claim_invite_use` for a join that didn't happen"""
+
+    await invites.update_one(
+        {"_id" : invite_id, "uses" : {"$gt" : 0}},
+        {"$inc" : {"uses" : -1}}
+    )
+
+async def get_pending_invite_uses(invite_code : str) -> Dict[str, int]:
+    """The joins that haven't been flushed to mongo yet, as `{day : count}`"""
+
+    redis = await get_redis()
+
+    pending = {}
+
+    for key in (PROCESSING_INVITE_USES_KEY, PENDING_INVITE_USES_KEY):
+        async for field, count in redis.hscan_iter(key, match=f"{invite_code}|*"):
+            day = _decode(field).split("|", 1)[1]
+            pending[day] = pending.get(day, 0) + int(count)
+
+    return pending
+
+async def flush_invite_usage() -> None:
+    """
+        Moves the pending redis counters onto the invites' `uses_by_day` in one bulk write.
+
+        The counters are renamed aside rather than read and deleted, and only removed once mongo has them.
+        A flush that fails part way leaves them there for the next one to retry, so joins are never lost
+        (though a flush that dies between the write and the delete will count its batch twice).
+    """
+
+    redis = await get_redis()
+
+    if not await redis.set(INVITE_USAGE_FLUSH_LOCK_KEY, 1, nx=True, ex=INVITE_USAGE_FLUSH_SECONDS * 3):
+        return
+
+    try:
+        # Left over from a failed flush, retry those first and leave the new counters for the next round
+        if not await redis.exists(PROCESSING_INVITE_USES_KEY):
+
+            # RENAMENX is atomic, joins counted after it start a fresh pending hash
+            if not await redis.exists(PENDING_INVITE_USES_KEY):
+                return
+
+            await redis.renamenx(PENDING_INVITE_USES_KEY, PROCESSING_INVITE_USES_KEY)
+
+        pending = await redis.hgetall(PROCESSING_INVITE_USES_KEY)
+
+        if pending:
+            increments = defaultdict(dict)
+
+            for field, count in pending.items():
+                invite_code, day = _decode(field).split("|", 1)
+                increments[invite_code][f"uses_by_day.{day}"] = int(count)
+
+            db = await get_database()
+
+            # Invites that were deleted in the meantime just don't match
+            await db.get_collection("invites").bulk_write(
+                [UpdateOne({"invite_code" : code}, {"$inc" : inc}) for code, inc in increments.items()],
+                ordered=False
+            )
+
+        await redis.delete(PROCESSING_INVITE_USES_KEY)
+
+    finally:
+        await redis.delete(INVITE_USAGE_FLUSH_LOCK_KEY)
+
+class InviteUsageFlusher(object):
+
+    @classmethod
+    async def run(cls) -> None:
+
+        while True:
+            await asyncio.sleep(INVITE_USAGE_FLUSH_SECONDS)
+
+            # A failed flush leaves its counters for the next one, and shouldn't stop it from happening
+            try:
+                await flush_invite_usage()
+            except (RedisError, PyMongoError):
+                logger.exception("Failed to flush invite usage, retrying next round")
+
+    @classmethod
+    def using_app(cls, app : FastAPI) -> None:
+
+        @app.on_event("startup")
+        async def start_invite_usage_flusher() -> None:
+            app.state.invite_usage_flusher = asyncio.create_task(cls.run())
+
+        @app.on_event("shutdown")
+        async def stop_invite_usage_flusher() -> None:
+            app.state.invite_usage_flusher.cancel()
+
+__all__ = [
+    PENDING_INVITE_USES_KEY,
+    PROCESSING_INVITE_USES_KEY,
+    INVITE_USAGE_FLUSH_LOCK_KEY,
+    count_invite_use,
+    claim_invite_use,
+    release_invite_use,
+    get_pending_invite_uses,
+    flush_invite_usage,
+    InviteUsageFlusher
+]
@@ -0,0 +1,82 @@
+import asyncio
+from typing import Dict, List
+
+from fastapi import FastAPI
+from redis.exceptions import RedisError
+
+from delve_common._db._redis import get_redis
+from delve_common._types._dtos._communities._member import Member
+
+from .constants import MEMBER_JOIN_FLUSH_SECONDS, MAX_MEMBERS_JOINED_BATCH
+from .events import MembersJoinedEvent
+from .utils import dump_basemodel_to_json_bytes
+
+class MemberJoinCoalescer(object):
+    """
+        Buffers member joins per community and publishes them as batched `members_joined` events
+        every `MEMBER_JOIN_FLUSH_SECONDS`, so a join storm reaches each gateway as a handful of frames.
+    """
+
+    pending : Dict[str, List[Member]] = {}
+
+    @classmethod
+    def add(cls, member : Member) -> None:
+        cls.pending.setdefault(str(member.community_id), []).append(member)
+
+    @classmethod
+    async def flush(cls) -> None:
+
+        if not cls.pending:
+            return
+
+        pending, cls.pending = cls.pending, {}
+
+        redis = await get_redis()
+        pipe = redis.pipeline(transaction=False)
+
+        for community_id, members in pending.items():
+            for i in range(0, len(members), MAX_MEMBERS_JOINED_BATCH):
+                pipe.publish(
+                    f"members_joined.{community_id}",
+                    dump_basemodel_to_json_bytes(
+                        MembersJoinedEvent(
+                            community_id=community_id,
+                            members=members[i:i + MAX_MEMBERS_JOINED_BATCH]
+                        )
+                    )
+                )
+
+        await pipe.execute()
+
+    @classmethod
+    async def run(cls) -> None:
+
+        while True:
+            await asyncio.sleep(MEMBER_JOIN_FLUSH_SECONDS)
+
+            # Keep flushing after a redis blip, the failed batch is lost the same way a plain publish would be
+            try:
+                await cls.flush()
+            except RedisError:
+                continue
+
+    @classmethod
+    def using_app(cls, app : FastAPI) -> None:
+
+        @app.on_event("startup")
+        async def start_member_join_coalescer() -> None:
+            app.state.member_join_coalescer = asyncio.create_task(cls.run())
+
+        @app.on_event("shutdown")
+        async def stop_member_join_coalescer() -> None:
+            app.state.member_join_coalescer.cancel()
+
+            # Don't drop the joins still waiting on the next flush
+            try:
+                await cls.flush()
+            except RedisError:
+                pass
+
+__all__ = [
+    MemberJoinCoalescer
+]
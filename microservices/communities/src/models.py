@@ -1,10 +1,15 @@
 from pydantic import BaseModel, Field
 from pydantic import computed_field
+from datetime import datetime
 from typing import Dict, List, Optional, Union
 from delve_common._types._dtos._communities._member import Member
 from delve_common._types._dtos._user import User
 from delve_common.permissions import Permissions
 from delve_common._types._dtos._communities._role import Role
+from delve_common._types._dtos._message import Message, MessageContent
+
+from .constants import MAX_MEMBER_BATCH_SIZE, MAX_BULK_MESSAGES, MAX_SLOWMODE_SECONDS
+from .permissions import DEFAULT_PERMISSION_MASK, has_permission, permissions_from_mask
 
 class ChannelSpec(BaseModel):
 
@@ -35,6 +40,9 @@ class CommunityEditRequest(BaseModel):
 class MemberEditRequest(BaseModel):
     nickname : Optional[str] = Field(default=None)
 
+class MemberBatchRequest(BaseModel):
+    user_ids : List[str] = Field(min_length=1, max_length=MAX_MEMBER_BATCH_SIZE)
+
 class MemberWithEmbeddedUser(Member):
     user : User
 
@@ -43,6 +51,43 @@ class ChannelCreationRequest(BaseModel):
 
 class ChannelUpdateRequest(BaseModel):
     name : Optional[str] = Field(default=None)
+    position : Optional[int] = Field(default=None, ge=0)
+
+    # 0 turns slow mode off
+    slowmode_seconds : Optional[int] = Field(default=None, ge=0, le=MAX_SLOWMODE_SECONDS)
+
+class BulkMessageCreateRequest(BaseModel):
+    messages : List[MessageContent] = Field(min_length=1, max_length=MAX_BULK_MESSAGES)
+
+class BulkMessageResult(BaseModel):
+    index : int
+    message : Optional[Message] = Field(default=None)
+    error : Optional[str] = Field(default=None)
+
+class MessageRevision(BaseModel):
+    revision : int
+    text : str
+
+    # When this revision was written, ie. when the message was sent or edited into it
+    written_at : Optional[datetime]
+
+class InviteUsage(BaseModel):
+    invite_code : str
+
+    # Joins through this invite, including the ones not yet flushed from redis
+    uses : int
+    uses_by_day : Dict[str, int]
+
+    max_uses : Optional[int]
+    remaining_uses : Optional[int]
+
+class CommunityDeletionStatus(BaseModel):
+    community_id : str
+    deleted_at : datetime
+
+    # Documents purged so far, by collection
+    purged : Dict[str, int]
+    completed_at : Optional[datetime]
 
 class RolePositionsUpdate(BaseModel):
     role_id : str
@@ -69,12 +114,13 @@ class FullMember(Member):
         
         return None
     
+    # Effective permissions compiled from `roles`, see `permissions.get_permission_mask`
+    permission_mask : int = Field(default=DEFAULT_PERMISSION_MASK, exclude=True)
+
     @computed_field
     @property
     def permissions(self) -> Permissions:
-        p = Permissions.default()
-
-        for r in self.roles[::-1]:
-            p = p.override(Permissions(**r.permisson_overrides))
+        return permissions_from_mask(self.permission_mask)
 
-        return p
+    def has_permission(self, name : str) -> bool:
+        return has_permission(self.permission_mask, name)
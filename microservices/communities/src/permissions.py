@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+from delve_common.permissions import Permissions
+
+# Every permission gets a bit, in the order they're declared on the `Permissions` model
+PERMISSION_FLAGS : Dict[str, int] = {
+    name : 1 << i for i, name in enumerate(Permissions.model_fields)
+}
+
+# The field on a community document that is bumped whenever its roles change
+ROLES_VERSION_FIELD = "roles_version"
+
+# How many (community, roles version, role set) masks are kept in memory per worker
+PERMISSION_CACHE_SIZE = 4096
+
+def mask_from_permissions(p : Permissions) -> int:
+    """Packs every truthy permission into an integer bitmask"""
+
+    mask = 0
+
+    for name, flag in PERMISSION_FLAGS.items():
+        if getattr(p, name, None):
+            mask |= flag
+
+    return mask
+
+def permissions_from_mask(mask : int) -> Permissions:
+    return Permissions(**{name : bool(mask & flag) for name, flag in PERMISSION_FLAGS.items()})
+
+DEFAULT_PERMISSION_MASK = mask_from_permissions(Permissions.default())
+
+def compile_role_overrides(overrides : Dict[str, bool]) -> Tuple[int, int]:
+    """Compiles a role's permission overrides into an `(allow, deny)` pair of bitmasks"""
+
+    allow, deny = 0, 0
+
+    for name, value in (overrides or {}).items():
+
+        if name not in PERMISSION_FLAGS or value is None:
+            continue
+
+        if value:
+            allow |= PERMISSION_FLAGS[name]
+        else:
+            deny |= PERMISSION_FLAGS[name]
+
+    return allow, deny
+
+def compile_permission_mask(role_overrides : Iterable[Dict[str, bool]]) -> int:
+    """
+        Folds role overrides (highest role first, like `Community.roles`) into an effective mask.
+        Lower roles are applied first so that the higher roles win.
+    """
+
+    mask = DEFAULT_PERMISSION_MASK
+
+    for overrides in list(role_overrides)[::-1]:
+        allow, deny = compile_role_overrides(overrides)
+        mask = (mask & ~deny) | allow
+
+    return mask
+
+__mask_cache : "OrderedDict[Tuple[str, int, Tuple[str, ...]], int]" = OrderedDict()
+
+def get_permission_mask(
+    community_id : str,
+    roles_version : int,
+    member_roles : List[dict]
+) -> int:
+    """
+        Returns the effective permission mask for a member holding `member_roles` (raw role documents,
+        highest first). Masks are cached per community and roles version, so any role change in the
+        community (which bumps the version) naturally stops old masks from being used.
+    """
+
+    key = (str(community_id), roles_version, tuple(str(r["_id"]) for r in member_roles))
+
+    if key in __mask_cache:
+        __mask_cache.move_to_end(key)
+        return __mask_cache[key]
+
+    mask = compile_permission_mask(r.get("permission_overrides", {}) for r in member_roles)
+
+    __mask_cache[key] = mask
+
+    if len(__mask_cache) > PERMISSION_CACHE_SIZE:
+        __mask_cache.popitem(last=False)
+
+    return mask
+
+def has_permission(mask : int, name : str) -> bool:
+    return bool(mask & PERMISSION_FLAGS[name])
+
+__all__ = [
+    PERMISSION_FLAGS,
+    ROLES_VERSION_FIELD,
+    DEFAULT_PERMISSION_MASK,
+    mask_from_permissions,
+    permissions_from_mask,
+    compile_role_overrides,
+    compile_permission_mask,
+    get_permission_mask,
+    has_permission
+]
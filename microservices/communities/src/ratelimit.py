@@ -0,0 +1,149 @@
+from time import monotonic, time
+from typing import List, Tuple
+
+from delve_common._db._redis import get_redis
+
+from .cache import LRUCache
+from .constants import (
+    BULK_MESSAGE_RATE_BURST,
+    BULK_MESSAGE_RATE_WINDOW_SECONDS,
+    MESSAGE_RATE_BURST,
+    MESSAGE_RATE_WINDOW_SECONDS,
+    RATE_LIMIT_LOCAL_CACHE_SIZE
+)
+
+async def within_rate_limit(key : str, limit : int, window_seconds : int) -> bool:
+    """
+        Fixed window counter shared by every worker, counts this call and returns whether
+        it's still within `limit` calls for the current window. Costs one redis round trip.
+    """
+
+    redis = await get_redis()
+
+    window_key = f"rate_limit.{key}.{int(time()) // window_seconds}"
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.incr(window_key)
+    pipe.expire(window_key, window_seconds)
+    count, _ = await pipe.execute()
+
+    return count <= limit
+
+# Takes one token from every bucket in KEYS, or from none of them if any bucket is empty.
+# ARGV holds `capacity, refill per ms` for each key. Returns 0 on success,
+# otherwise how many ms until every bucket has a token again.
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local tokens = {}
+local wait = 0
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local t = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+
+    t = math.min(capacity, t + (now - ts) * rate)
+    tokens[i] = t
+
+    if t < 1 then
+        wait = math.max(wait, math.ceil((1 - t) / rate))
+    end
+end
+
+if wait > 0 then
+    return wait
+end
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate))
+end
+
+return 0
+"""
+
+_token_bucket = None
+
+async def take_tokens(buckets : List[Tuple[str, int, float]]) -> float:
+    """
+        Atomically takes a token from each `(key, capacity, refill per second)` bucket.
+        Returns 0 if they were taken, otherwise the seconds to wait before retrying.
+    """
+
+    global _token_bucket
+
+    redis = await get_redis()
+
+    # Registered once, later calls go out as EVALSHA
+    if _token_bucket is None:
+        _token_bucket = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    args = []
+
+    for _, capacity, per_second in buckets:
+        args.extend([capacity, per_second / 1000])
+
+    wait_ms = await _token_bucket(keys=[f"token_bucket.{k}" for k, _, _ in buckets], args=args)
+
+    return int(wait_ms) / 1000
+
+# (kind, user_id, channel_id) -> monotonic time until which this worker already knows the user is limited
+rate_limited_until : LRUCache[Tuple[str, str, str], float] = LRUCache(RATE_LIMIT_LOCAL_CACHE_SIZE)
+
+async def _check_rate(local_key : Tuple[str, str, str], buckets : List[Tuple[str, int, float]]) -> float:
+
+    now = monotonic()
+    until = rate_limited_until.get(local_key)
+
+    if until is not None and until > now:
+        return until - now
+
+    wait = await take_tokens(buckets)
+
+    if wait:
+        rate_limited_until.set(local_key, now + wait)
+
+    return wait
+
+async def check_message_rate(user_id : str, channel_id : str, slowmode_seconds : int) -> float:
+    """
+        Applies the per-user message rate limit, and the channel's slow mode if it has one.
+        Returns 0 if the user may send a message now, otherwise the seconds until they may.
+
+        A user who was just limited is rejected from memory until their wait is over,
+        so a flood against one worker doesn't cost a redis call per attempt.
+    """
+
+    return await _check_rate(
+        ("message", user_id, channel_id),
+        [
+            (f"messages.{user_id}", MESSAGE_RATE_BURST, MESSAGE_RATE_BURST / MESSAGE_RATE_WINDOW_SECONDS),
+            *([(f"slowmode.{channel_id}.{user_id}", 1, 1 / slowmode_seconds)] if slowmode_seconds else [])
+        ]
+    )
+
+async def check_bulk_message_rate(user_id : str, channel_id : str) -> float:
+    """
+        As `check_message_rate`, for a whole bulk request. Batches draw from their own per-user bucket.
+        Slow mode isn't checked here, bulk sends are refused outright in slow mode channels.
+    """
+
+    return await _check_rate(
+        ("bulk", user_id, channel_id),
+        [(f"bulk_messages.{user_id}", BULK_MESSAGE_RATE_BURST, BULK_MESSAGE_RATE_BURST / BULK_MESSAGE_RATE_WINDOW_SECONDS)]
+    )
+
+__all__ = [
+    within_rate_limit,
+    TOKEN_BUCKET_SCRIPT,
+    take_tokens,
+    rate_limited_until,
+    check_message_rate,
+    check_bulk_message_rate
+]
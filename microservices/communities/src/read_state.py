@@ -0,0 +1,100 @@
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+
+from delve_common._db._database import get_database
+from delve_common._db._redis import get_redis
+
+# Per-channel message sequence numbers, incremented for every message created in the channel
+def channel_seq_key(channel_id : str) -> str:
+    return f"channel_seq.{channel_id}"
+
+# Per-user hash of `{channel_id : last read sequence number}`
+def read_state_key(user_id : str) -> str:
+    return f"read_state.{user_id}"
+
+def _decode(v) -> str:
+    return v.decode("utf-8") if isinstance(v, bytes) else v
+
+async def ack_channel(user_id : str, channel_id : str, seq : Optional[int] = None) -> int:
+    """Marks a channel as read up to `seq` (or everything in it) and returns the stored marker"""
+
+    redis = await get_redis()
+
+    if seq is None:
+        seq = int(await redis.get(channel_seq_key(channel_id)) or 0)
+
+    await redis.hset(read_state_key(user_id), channel_id, seq)
+
+    return seq
+
+# Bumps a channel's sequence number by ARGV[1] and moves the author's read marker (field ARGV[2] of KEYS[2])
+# up to the new value, so the author's own messages never count as unread to them. Returns the new sequence number
+MESSAGES_SENT_SCRIPT = """
+local seq = redis.call('INCRBY', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[2], seq)
+return seq
+"""
+
+_messages_sent = None
+
+async def queue_messages_sent(pipe, channel_id : str, author_id : str, count : int = 1) -> None:
+    """Queues the sequence bump for `count` new messages, and the author's ack of them, onto a redis pipeline"""
+
+    global _messages_sent
+
+    # Registered once, later calls go out as EVALSHA
+    if _messages_sent is None:
+        _messages_sent = (await get_redis()).register_script(MESSAGES_SENT_SCRIPT)
+
+    await _messages_sent(
+        keys=[channel_seq_key(channel_id), read_state_key(author_id)],
+        args=[count, channel_id],
+        client=pipe
+    )
+
+async def get_unread_counts(user_id : str, community_ids : List[str]) -> Dict[str, Dict[str, int]]:
+    """
+        Returns `{community_id : {channel_id : unread count}}` for every channel of the given communities,
+        using one mongo query for the channel ids and one redis round trip for all of the counters.
+    """
+
+    if not community_ids:
+        return {}
+
+    db = await get_database()
+    redis = await get_redis()
+
+    channels = await db.get_collection("channels").find(
+        {"community_id" : {"$in" : [ObjectId(c) for c in community_ids]}},
+        {"_id" : 1, "community_id" : 1}
+    ).to_list(None)
+
+    if not channels:
+        return {}
+
+    channel_ids = [str(c["_id"]) for c in channels]
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.hgetall(read_state_key(user_id))
+    pipe.mget([channel_seq_key(c) for c in channel_ids])
+    read_markers, seqs = await pipe.execute()
+
+    read_markers = {_decode(k) : int(v) for k, v in read_markers.items()}
+
+    unread = {}
+
+    for chan, channel_id, seq in zip(channels, channel_ids, seqs):
+        count = max(int(seq or 0) - read_markers.get(channel_id, 0), 0)
+        unread.setdefault(str(chan["community_id"]), {})[channel_id] = count
+
+    return unread
+
+__all__ = [
+    channel_seq_key,
+    read_state_key,
+    ack_channel,
+    MESSAGES_SENT_SCRIPT,
+    queue_messages_sent,
+    get_unread_counts
+]
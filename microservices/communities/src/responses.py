@@ -0,0 +1,110 @@
+from os import getenv
+from typing import Any, AsyncIterator, List
+import zlib
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import StreamingResponse
+
+from .converters import DocumentConverter
+
+# Turns the raw response path back into full pydantic validation, for debugging
+VALIDATE_RESPONSES = getenv("VALIDATE_RESPONSES", "false").lower() == "true"
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def _default(v : Any) -> Any:
+    if isinstance(v, ObjectId):
+        return str(v)
+
+    raise TypeError(f"Type is not JSON serializable: {type(v).__name__}")
+
+def encode_document(d : dict, converter : DocumentConverter) -> bytes:
+    """
+        Encodes a document straight from mongo into JSON, ObjectIds are turned into strings
+        by the encoder itself. The document is cut down to the dto's fields (see `DocumentConverter.shape`),
+        so the output matches what the pydantic path would produce.
+    """
+
+    if VALIDATE_RESPONSES:
+        return orjson.dumps(converter.load(d).model_dump(mode="json"))
+
+    return orjson.dumps(converter.shape(d), default=_default)
+
+def encode_document_list(docs : List[dict], converter : DocumentConverter) -> bytes:
+    """Encodes a list of mongo documents into a JSON array, eg. to be cached and served as is"""
+    return b"[" + b",".join(encode_document(d, converter) for d in docs) + b"]"
+
+async def _stream_json_array(cursor : AsyncIterator[dict], converter : DocumentConverter) -> AsyncIterator[bytes]:
+
+    yield b"["
+
+    first = True
+
+    async for d in cursor:
+
+        if not first:
+            yield b","
+
+        first = False
+        yield encode_document(d, converter)
+
+    yield b"]"
+
+def raw_json_list_response(cursor : AsyncIterator[dict], converter : DocumentConverter) -> StreamingResponse:
+    """
+        Streams the documents of a mongo cursor out as a JSON array, skipping the pydantic models
+        (and FastAPI's re-validation of them) for trusted database output.
+        The route keeps its return annotation, so the OpenAPI schema is unaffected.
+    """
+
+    return StreamingResponse(
+        _stream_json_array(cursor, converter),
+        media_type="application/json"
+    )
+
+async def _stream_ndjson(cursor : AsyncIterator[dict], converter : DocumentConverter, compress : bool) -> AsyncIterator[bytes]:
+
+    # wbits=31 produces a gzip container rather than a raw zlib stream
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    async for d in cursor:
+        line = encode_document(d, converter) + b"\n"
+
+        if compressor is None:
+            yield line
+            continue
+
+        chunk = compressor.compress(line)
+
+        if chunk:
+            yield chunk
+
+    if compressor is not None:
+        yield compressor.flush()
+
+def ndjson_response(
+    cursor : AsyncIterator[dict],
+    converter : DocumentConverter,
+    *,
+    compress : bool = False
+) -> StreamingResponse:
+    """
+        Streams the documents of a mongo cursor out as newline delimited JSON, one document per line,
+        optionally gzipped. Memory use stays constant no matter how many documents the cursor yields.
+    """
+
+    return StreamingResponse(
+        _stream_ndjson(cursor, converter, compress),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={"Content-Encoding" : "gzip"} if compress else None
+    )
+
+__all__ = [
+    VALIDATE_RESPONSES,
+    NDJSON_MEDIA_TYPE,
+    encode_document,
+    encode_document_list,
+    raw_json_list_response,
+    ndjson_response
+]
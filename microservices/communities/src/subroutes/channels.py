@@ -1,18 +1,30 @@
 
 from datetime import UTC, datetime
-from typing import List, Annotated
-from fastapi import Depends
+from typing import List, Annotated, Optional
+from fastapi import Depends, Query, Response
 from fastapi.routing import APIRouter
 from bson import ObjectId
 from pymongo import ReturnDocument
-from copy import copy
 
-from ..constants import X_USER_HEADER
+from ..constants import X_USER_HEADER, CHANNEL_POSITION_SEQ_FIELD
 from ..models import (
     ChannelCreationRequest, 
     ChannelUpdateRequest
 )
-from ..utils import objectid_fix, dump_basemodel_to_json_bytes
+from ..utils import dump_basemodel_to_json_bytes
+from ..converters import channel_converter
+from ..responses import encode_document, encode_document_list
+from ..cache import (
+    COMMUNITY_VERSION_FIELD,
+    channel_list_cache,
+    get_channel_slowmode,
+    get_community_snapshot,
+    get_joined_community_ids,
+    invalidate_channel_list,
+    invalidate_channel_settings,
+    invalidate_community
+)
+from ..read_state import ack_channel, channel_seq_key
 
 from delve_common._types._dtos._communities._channel import Channel
 from delve_common._types._dtos._communities._community import Community
@@ -42,16 +54,23 @@ async def get_all_channels(
     # NOTE: This doesn't double check to make sure that the community exists,
     # but it'll return nothing at all if the community doesnt exist anyways so
     # it doesn't *technically* matter.
-    
-    db = await get_database()
 
-    res = db.get_collection("channels").find({"community_id" : ObjectId(community_id)})
+    # Opening a community lands here, so the encoded list is kept until a channel event invalidates it
+    body = channel_list_cache.get(community_id)
+
+    if body is None:
+        db = await get_database()
+        generation = channel_list_cache.generation
+
+        docs = await db.get_collection("channels").find(
+            {"community_id" : ObjectId(community_id)},
+            channel_converter.projection
+        ).sort([("position", 1), ("_id", 1)]).to_list(None)
 
-    return [
-        Channel(**objectid_fix(
-            c, desired_outcome="str"
-        )) async for c in res 
-    ]
+        body = encode_document_list(docs, channel_converter)
+        channel_list_cache.set(community_id, body, generation=generation)
+
+    return Response(content=body, media_type="application/json")
 
 @router.post("/{community_id}/channels")
 async def create_channel(
@@ -63,11 +82,9 @@ async def create_channel(
     redis = await get_redis()
     db = await get_database()
 
-    community = await db.get_collection("communities").find_one(
-        {"_id" : ObjectId(community_id)}
-    )
+    snapshot = await get_community_snapshot(community_id)
 
-    if not community:
+    if not snapshot:
         raise DelveHTTPException(
             status_code=404,
             detail="Failed to find community",
@@ -77,9 +94,7 @@ async def create_channel(
             }
         )
     
-    community = Community(**objectid_fix(
-        community, desired_outcome="str"
-    ))
+    _, community = snapshot
     
     #  TODO<advanced_perms>: This needs to be changed when implementing a proper permissions system
     if x_user != community.owner_id:
@@ -95,10 +110,32 @@ async def create_channel(
         name = channel_creation_req.name
     )
 
-    resp = await db.get_collection("channels").insert_one(
-        objectid_fix(channel.model_dump(), desired_outcome="oid")
+    # Takes the next channel position and lists the channel on the community in one write
+    comm_doc = await db.get_collection("communities").find_one_and_update(
+        {"_id" : ObjectId(community_id)},
+        {
+            "$push" : {"channel_ids" : ObjectId(channel.id)},
+            "$inc" : {CHANNEL_POSITION_SEQ_FIELD : 1, COMMUNITY_VERSION_FIELD : 1}
+        },
+        projection={CHANNEL_POSITION_SEQ_FIELD : 1},
+        return_document=ReturnDocument.BEFORE
     )
 
+    if not comm_doc:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Failed to find community",
+            identifier="community_not_found"
+        )
+
+    resp = await db.get_collection("channels").insert_one({
+        **channel_converter.dump(channel),
+        "position" : comm_doc.get(CHANNEL_POSITION_SEQ_FIELD, 0)
+    })
+
+    invalidate_community(community_id)
+    invalidate_channel_list(community_id)
+
     if not resp.inserted_id:
         raise DelveHTTPException(
             status_code=500,
@@ -139,10 +176,36 @@ async def get_channel_by_id(
             identifier="failed_to_find_channel"
         )
     
-    chan = Channel(**objectid_fix(res, desired_outcome="str"))
+    chan = channel_converter.load(res)
 
     return chan
 
+@router.post("/{community_id}/channels/{channel_id}/ack")
+async def ack_channel_messages(
+    x_user : Annotated[str, Depends(X_USER_HEADER)],
+    community_id : str,
+    channel_id : str,
+    seq : Optional[int] = Query(default=None, ge=0)
+) -> int:
+    """Marks the channel as read, up to `seq` if given, and returns the stored read marker"""
+
+    # Both checks are served from this worker's caches, and keep read markers for channels the user can't see out of redis
+    if community_id not in await get_joined_community_ids(x_user):
+        raise DelveHTTPException(
+            status_code=401,
+            detail="User is not a member of this community",
+            identifier="user_not_member"
+        )
+
+    if await get_channel_slowmode(community_id, channel_id) is None:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Failed to find channel",
+            identifier="channel_not_found"
+        )
+
+    return await ack_channel(x_user, channel_id, seq)
+
 @router.patch("/{community_id}/channels/{channel_id}")
 async def update_channel(
     x_user : Annotated[str, Depends(X_USER_HEADER)],
@@ -156,20 +219,16 @@ async def update_channel(
 
     diff = channel_update_req.model_dump(exclude_none=True)
 
-    comm = await db.get_collection("communities").find_one(
-        {"_id" : ObjectId(community_id)}
-    )
+    snapshot = await get_community_snapshot(community_id)
 
-    if not comm:
+    if not snapshot:
         raise DelveHTTPException(
             status_code=404,
             detail="Failed to find community",
             identifier="community_not_found"
         )
     
-    comm = Community(
-        **objectid_fix(comm, desired_outcome="str")
-    )
+    _, comm = snapshot
 
     # TODO<advanced_permissions>: You know what to do
     if comm.owner_id != x_user:
@@ -179,9 +238,11 @@ async def update_channel(
             identifier="lacking_permissions"
         )
     
+    changes = {**diff, "edited_at" : datetime.now(tz=UTC)}
+
     before_res = await db.get_collection("channels").find_one_and_update(
         {"community_id" : ObjectId(comm.id), "_id" : ObjectId(channel_id)},
-        {"$set" : {**diff, "edited_at" : datetime.now(tz=UTC)}},
+        {"$set" : changes},
         return_document=ReturnDocument.BEFORE
     )
 
@@ -192,26 +253,26 @@ async def update_channel(
             identifier="channel_not_found"
         )
     
-    before_channel = Channel(**objectid_fix(before_res, desired_outcome="str"))
+    invalidate_channel_list(community_id)
+    invalidate_channel_settings(channel_id)
 
-    after_channel = copy(before_channel)
+    # The document as the `$set` left it. Worked on as a raw document because `position` and
+    # `slowmode_seconds` aren't fields of the Channel dto, so they can't be set on one
+    after_res = {**before_res, **changes}
 
-    for k, v in {**diff, "edited_at" : datetime.now(tz=UTC)}.items():
-        setattr(after_channel, k, v)
-    
     await redis.publish(
         f"channel_modified.{comm.id}.{channel_id}",
         dump_basemodel_to_json_bytes(
             ChannelModifiedEvent(
                 community_id=comm.id,
                 channel_id=channel_id,
-                before = before_channel,
-                after = after_channel
+                before = channel_converter.load(before_res),
+                after = channel_converter.load(after_res)
             )
         )
     )
     
-    return after_channel
+    return Response(content=encode_document(after_res, channel_converter), media_type="application/json")
 
 @router.delete("/{community_id}/channels/{channel_id}")
 async def delete_channel(
@@ -223,18 +284,16 @@ async def delete_channel(
     redis = await get_redis()
     db = await get_database()
 
-    comm = await db.get_collection("communities").find_one(
-        {"_id" : ObjectId(community_id)}
-    )
+    snapshot = await get_community_snapshot(community_id)
 
-    if not comm:
+    if not snapshot:
         raise DelveHTTPException(
             status_code=404,
             detail="Community not found",
             identifier="community_not_found"
         )
     
-    comm = Community(**objectid_fix(comm, desired_outcome="str"))
+    _, comm = snapshot
 
     # TODO<advanced_perms>: Yeah.
     if x_user != comm.owner_id:
@@ -244,7 +303,9 @@ async def delete_channel(
             identifier="lacking_permissions"
         )
     
-    res = await db.get_collection("channels").delete_one({"_id" : ObjectId(channel_id)})
+    res = await db.get_collection("channels").delete_one(
+        {"_id" : ObjectId(channel_id), "community_id" : ObjectId(community_id)}
+    )
 
     if res.deleted_count != 1:
         raise DelveHTTPException(
@@ -252,6 +313,17 @@ async def delete_channel(
             detail="Failed to find channel",
             identifier="channel_not_found"
         )
+
+    await db.get_collection("communities").update_one(
+        {"_id" : ObjectId(community_id)},
+        {"$pull" : {"channel_ids" : ObjectId(channel_id)}, "$inc" : {COMMUNITY_VERSION_FIELD : 1}}
+    )
+
+    invalidate_community(community_id)
+    invalidate_channel_list(community_id)
+    invalidate_channel_settings(channel_id)
+
+    await redis.delete(channel_seq_key(channel_id))
     
     await redis.publish(
         f"channel_deleted.{community_id}.{channel_id}",
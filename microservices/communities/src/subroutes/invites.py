@@ -1,13 +1,27 @@
 from datetime import UTC, datetime, timedelta
-import random
+import secrets
 import string
-import pytz
 from bson import ObjectId
 from fastapi import APIRouter, Depends, Query
+from pymongo.errors import DuplicateKeyError
 from typing import Annotated, List, Optional
 
-from ..constants import X_USER_HEADER
-from ..utils import objectid_fix, dump_basemodel_to_json_bytes
+from ..constants import (
+    X_USER_HEADER,
+    INVITE_CODE_LENGTH,
+    INVITE_CODE_ATTEMPTS,
+    INVITE_JOIN_RATE_LIMIT,
+    INVITE_JOIN_RATE_WINDOW_SECONDS
+)
+from ..utils import dump_basemodel_to_json_bytes
+from ..converters import invite_converter, member_converter
+from ..responses import raw_json_list_response
+from ..cache import get_community_snapshot, get_invite, invalidate_invite, invalidate_joined_communities
+from ..events import InviteDeletedEvent
+from ..join_events import MemberJoinCoalescer
+from ..ratelimit import within_rate_limit
+from ..invite_usage import claim_invite_use, count_invite_use, get_pending_invite_uses, release_invite_use
+from ..models import InviteUsage
 from delve_common._types._dtos._communities._invite import Invite
 from delve_common._types._dtos._communities._member import Member
 from delve_common._messages.communities import JoinedCommunityEvent
@@ -18,22 +32,24 @@ from delve_common.exceptions import DelveHTTPException
 
 router = APIRouter()
 
-async def check_if_invite_code_free(invite_code : str):
+def invite_expires_at(invite : dict) -> Optional[datetime]:
+    """When an invite document expires, if ever. Older invites only carry `valid_days`"""
 
-    db = await get_database()
+    expires_at = invite.get("expires_at")
 
-    resp = await db.get_collection("invites").find_one({
-        "invite_code" : invite_code
-    })
+    if expires_at is None and invite.get("valid_days") is not None:
+        expires_at = invite["created_at"] + timedelta(days=invite["valid_days"])
 
-    return resp is None
+    # Mongo hands datetimes back as naive UTC
+    if expires_at is not None and expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=UTC)
 
-def generate_invite_code(length : int = 6) -> str:
+    return expires_at
+
+def generate_invite_code(length : int = INVITE_CODE_LENGTH) -> str:
     return "".join(
-        random.choices(
-            string.ascii_letters,
-            k = length
-        )
+        secrets.choice(string.ascii_letters)
+        for _ in range(length)
     )
 
 # CREATE AN INVITE
@@ -41,14 +57,13 @@ def generate_invite_code(length : int = 6) -> str:
 async def create_invite_code(
     x_user : Annotated[str, Depends(X_USER_HEADER)],
     community_id : str,
-    valid_days : int | None = Query(default=None, gt=0, lte=30, )
+    valid_days : int | None = Query(default=None, gt=0, lte=30, ),
+    max_uses : int | None = Query(default=None, gt=0)
 ) -> Invite:    
 
     db = await get_database()
 
-    community = await db.get_collection("communities").find_one({"_id" : ObjectId(community_id)})
-
-    if not community:
+    if not await get_community_snapshot(community_id):
         raise DelveHTTPException(
             status_code=404,
             detail="Failed to find community",
@@ -57,47 +72,47 @@ async def create_invite_code(
                 "community_id" : community_id
             }
         )
-    
-    iter_count = 0
+
     failed_codes = []
-    while True:
-        iter_count += 1 # Safety to avoid an infinite loop
 
-        invite_code = generate_invite_code()
-        is_code_free_check = await check_if_invite_code_free(invite_code)
+    # Insert-and-retry, the unique index on `invite_code` rejects a taken code in the same round trip
+    # as the write, so there's no lookup beforehand (or race between the lookup and the insert)
+    for _ in range(INVITE_CODE_ATTEMPTS):
 
-        if is_code_free_check:
-            break
+        invite = Invite(
+            id = str(ObjectId()),
+            community_id=community_id,
+            valid_days = valid_days,
+            author_id=x_user,
+            invite_code=generate_invite_code()
+        )
 
-        failed_codes.append(invite_code)
+        doc = invite_converter.dump(invite)
 
-        if iter_count >= 3:
-            raise DelveHTTPException(
-                status_code=409, # Conflict
-                detail="Failed to find a free invite code",
-                identifier="no_free_codes",
-                additional_metadata={
-                    "failed_codes" : failed_codes
-                }
-            )
-        
-    invite = Invite(
-        id = str(ObjectId()),
-        community_id=community_id,
-        valid_days = valid_days,
-        author_id=x_user,
-        invite_code=invite_code
-    )
+        if valid_days is not None:
+            doc["expires_at"] = invite.created_at + timedelta(days=valid_days)
 
-    resp = await db.get_collection("invites").insert_one(
-        objectid_fix(invite.model_dump(), desired_outcome="oid")
-    )
+        # `uses` is only kept exactly (and atomically) for invites that need it enforced
+        if max_uses is not None:
+            doc["max_uses"] = max_uses
+            doc["uses"] = 0
+
+        try:
+            await db.get_collection("invites").insert_one(doc)
+        except DuplicateKeyError:
+            failed_codes.append(invite.invite_code)
+            continue
+
+        break
 
-    if not resp:
+    else:
         raise DelveHTTPException(
-            status_code=500,
-            detail="Failed to create invite, something went very wrong!",
-            identifier="nightmare_error"
+            status_code=409, # Conflict
+            detail="Failed to find a free invite code",
+            identifier="no_free_codes",
+            additional_metadata={
+                "failed_codes" : failed_codes
+            }
         )
 
     # TODO<redis/polish>: Add an event for this, it's not *really* necessary though
@@ -124,13 +139,12 @@ async def get_community_invites(
             identifier="lacking_permissions"
         )
 
-    cur = db.get_collection("invites").find({
-        "community_id" : ObjectId(community_id)
-    })
+    cur = db.get_collection("invites").find(
+        {"community_id" : ObjectId(community_id)},
+        invite_converter.projection
+    )
 
-    return [
-        Invite(**objectid_fix(inv, desired_outcome="str")) async for inv in cur
-    ]
+    return raw_json_list_response(cur, invite_converter)
 
 # RETRIEVE AN INVITE
 @router.get('/{community_id}/invites/{invite_code}')
@@ -165,7 +179,57 @@ async def get_invite_by_code(
             identifier="invite_not_found"
         )
 
-    return Invite(**objectid_fix(invite, desired_outcome="str"))
+    return invite_converter.load(invite)
+
+# RETRIEVE AN INVITE'S USAGE
+@router.get('/{community_id}/invites/{invite_code}/usage')
+async def get_invite_usage(
+    x_user : Annotated[str, Depends(X_USER_HEADER)],
+    community_id : str,
+    invite_code : str
+) -> InviteUsage:
+
+    db = await get_database()
+
+    check_for_user = await db.get_collection("members").find_one({
+        "user_id" : ObjectId(x_user),
+        "community_id" : ObjectId(community_id)
+    })
+
+    if not check_for_user:
+        raise DelveHTTPException(
+            status_code=401,
+            detail="You do not have the permissions to access this resource",
+            identifier="lacking_permissions"
+        )
+
+    invite = await db.get_collection("invites").find_one(
+        {"invite_code" : invite_code, "community_id" : ObjectId(community_id)},
+        {"uses" : 1, "max_uses" : 1, "uses_by_day" : 1}
+    )
+
+    if not invite:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Invite not found",
+            identifier="invite_not_found"
+        )
+
+    # Add the counts that are still waiting in redis for the next flush
+    uses_by_day = invite.get("uses_by_day", {})
+
+    for day, count in (await get_pending_invite_uses(invite_code)).items():
+        uses_by_day[day] = uses_by_day.get(day, 0) + count
+
+    max_uses = invite.get("max_uses")
+
+    return InviteUsage(
+        invite_code=invite_code,
+        uses=sum(uses_by_day.values()),
+        uses_by_day=uses_by_day,
+        max_uses=max_uses,
+        remaining_uses=max(max_uses - invite.get("uses", 0), 0) if max_uses is not None else None
+    )
 
 # DELETE AN INVITE
 @router.delete("/{community_id}/invites/{invite_code}")
@@ -176,6 +240,7 @@ async def delete_invite_by_code(
 ) -> None:
     
     db = await get_database()
+    redis = await get_redis()
 
     resp = await db.get_collection('invites').delete_one({
         "community_id" : ObjectId(community_id),
@@ -190,6 +255,18 @@ async def delete_invite_by_code(
             identifier="invite_not_found"
         )
 
+    invalidate_invite(invite_code)
+
+    await redis.publish(
+        f"invite_deleted.{community_id}.{invite_code}",
+        dump_basemodel_to_json_bytes(
+            InviteDeletedEvent(
+                community_id=community_id,
+                invite_code=invite_code
+            )
+        )
+    )
+
     return
 
 # USE AN INVITE
@@ -202,64 +279,89 @@ async def use_invite_code(
     db = await get_database()
     redis = await get_redis()
 
-    await db.get_collection("members").create_index(
-        {"user_id" : 1, "community_id" : 1}, 
-        unique=True, 
-        name="members_composite_index"
-    )
+    # Throttles a single viral code before it costs anything beyond one redis round trip
+    if not await within_rate_limit(f"invite_join.{invite_code}", INVITE_JOIN_RATE_LIMIT, INVITE_JOIN_RATE_WINDOW_SECONDS):
+        raise DelveHTTPException(
+            status_code=429,
+            detail="This invite is being used too often, try again shortly",
+            identifier="rate_limited"
+        )
 
-    invite = await db.get_collection("invites").find_one(
-        {"invite_code" : invite_code}
-    )
+    # Served from this worker's invite cache for hot codes
+    invite = await get_invite(invite_code)
 
-    if not invite:
+    # Expired invites may linger for up to a minute before the TTL monitor removes them
+    if invite:
+        expires_at = invite_expires_at(invite)
+
+        if expires_at is not None and expires_at < datetime.now(tz=UTC):
+            raise DelveHTTPException(
+                status_code=410,
+                detail="Invite code is expired",
+                identifier="invite_code_expired"
+            )
+
+    if not invite or not await get_community_snapshot(str(invite["community_id"])):
         raise DelveHTTPException(
             status_code=404,
             identifier="community_not_found",
             detail="Failed to find community"
         )
 
-    resp = await db.get_collection("members").find_one(
-        {"user_id" : ObjectId(x_user), "community_id" : ObjectId(invite["community_id"])}
-    )
+    max_uses = invite.get("max_uses")
 
-    if resp:
-        raise DelveHTTPException(
-            status_code=400,
-            identifier="already_joined_community",
-            detail="You are already a member of this community!"
-        )
-    
-    invite = Invite(**objectid_fix(invite, desired_outcome="str"))
-
-    if invite.valid_days is not None and pytz.utc.localize(invite.created_at + timedelta(days=invite.valid_days)) < datetime.now(tz=UTC):
+    if max_uses is not None and not await claim_invite_use(db.get_collection("invites"), invite["_id"], max_uses):
         raise DelveHTTPException(
             status_code=410,
-            detail="Invite code is expired",
-            identifier="invite_code_expired"
+            detail="Invite code has reached its maximum number of uses",
+            identifier="invite_code_exhausted"
         )
-    
+
     new_member = Member(
         id=str(ObjectId()),
-        community_id=str(ObjectId(invite.community_id)),
+        community_id=str(invite["community_id"]),
         user_id=str(ObjectId(x_user))
     )
 
-    resp = await db.get_collection("members").insert_one(
-        objectid_fix(new_member.model_dump(), desired_outcome="oid")
-    )
+    # The unique (user_id, community_id) index makes the join idempotent, no need to look for the member first
+    try:
+        await db.get_collection("members").insert_one(
+            member_converter.dump(new_member)
+        )
+    except DuplicateKeyError:
 
-    await redis.publish(
-        f"member_joined.{str(invite.community_id)}.{x_user}",
+        # Hand the claimed use back, joining twice shouldn't use up an invite
+        if max_uses is not None:
+            await release_invite_use(db.get_collection("invites"), invite["_id"])
+
+        raise DelveHTTPException(
+            status_code=400,
+            identifier="already_joined_community",
+            detail="You are already a member of this community!"
+        )
+
+    invalidate_joined_communities(x_user)
+
+    # Only the joining user's own gateway listens to this, the rest of the community gets a batched `members_joined`
+    pipe = redis.pipeline(transaction=False)
+
+    pipe.publish(
+        f"member_joined.{new_member.community_id}.{x_user}",
         dump_basemodel_to_json_bytes(
             JoinedCommunityEvent(
-                community_id=str(invite.community_id),
+                community_id=new_member.community_id,
                 user_id=x_user,
                 member=new_member
             )
         )
     )
 
+    count_invite_use(pipe, invite_code)
+
+    await pipe.execute()
+
+    MemberJoinCoalescer.add(new_member)
+
     return new_member
 
 
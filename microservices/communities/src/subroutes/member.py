@@ -1,7 +1,7 @@
 from datetime import UTC, datetime
 from delve_common._types._dtos._communities._member import Member
 from typing import Annotated, List, Optional
-from fastapi import Body, Depends, FastAPI
+from fastapi import Body, Depends, FastAPI, Query
 from fastapi.routing import APIRouter
 from bson import ObjectId
 from pymongo import ReturnDocument
@@ -13,16 +13,20 @@ from delve_common.exceptions import DelveHTTPException
 from delve_common._types._dtos._communities import Community
 from delve_common._types._dtos._communities._member import Member
 from delve_common._types._dtos._communities._role import Role
-from ..utils import get_full_member, MemberNotFound
+from ..utils import get_full_member, get_full_members, resolve_full_members, MemberNotFound
 
-from ..models import FullMember, MemberEditRequest, MemberWithEmbeddedUser
+from ..models import FullMember, MemberBatchRequest, MemberEditRequest, MemberWithEmbeddedUser
 from delve_common._messages.communities import (
     MemberModifiedEvent, JoinedCommunityEvent, LeftCommunityEvent
 )
 
-from ..utils import objectid_fix, dump_basemodel_to_json_bytes
+from ..utils import dump_basemodel_to_json_bytes, queue_modified_events
+from ..converters import member_converter
+from ..diffs import model_delta
+from ..events import MEMBER_VERSION_FIELD, MemberDeltaEvent
 
-from ..constants import X_USER_HEADER
+from ..constants import X_USER_HEADER, MEMBER_PAGE_SIZE, MAX_MEMBER_PAGE_SIZE
+from ..cache import get_community_snapshot, invalidate_joined_communities, invalidate_role_members
 
 # --- MEMBER ENDPOINTS
 # CREATE A MEMBER (MEMBER JOIN)
@@ -58,6 +62,9 @@ async def member_leave_community(
                 "user_id" : user_id
             }
         )
+
+    invalidate_joined_communities(user_id)
+    invalidate_role_members(community_id)
     
     await redis.publish(
         f"member_left.{community_id}.{user_id}",
@@ -83,17 +90,17 @@ async def update_member(
     db = await get_database()
     redis = await get_redis()
 
-    comm = await db.get_collection("communities").find_one({'_id' : ObjectId(community_id)})
+    snapshot = await get_community_snapshot(community_id)
 
-    if not comm:
+    if not snapshot:
         raise DelveHTTPException(
             status_code=404,
             identifier="community_not_found",
             detail="Failed to find community"
         )
 
-    # Cast to ensure everything is fine, after this point is is assumed that the community must exist
-    comm = Community(**objectid_fix(comm, desired_outcome="str"))
+    # After this point is is assumed that the community must exist
+    _, comm = snapshot
 
     if auth_user_id != user_id and auth_user_id != comm.owner_id:
         raise DelveHTTPException(
@@ -113,7 +120,7 @@ async def update_member(
 
     before_resp = await db.get_collection("members").find_one_and_update(
         {"user_id" : ObjectId(user_id), "community_id" : ObjectId(community_id)},
-        {"$set" : diff},
+        {"$set" : diff, "$inc" : {MEMBER_VERSION_FIELD : 1}},
         return_document=ReturnDocument.BEFORE
     )
 
@@ -124,7 +131,7 @@ async def update_member(
             identifier="member_not_found"
         )
     
-    before_member = Member(**objectid_fix(before_resp, desired_outcome="str"))
+    before_member = member_converter.load(before_resp)
 
     # Create a copy and apply the new changes
     after_member = copy(before_member)
@@ -132,20 +139,43 @@ async def update_member(
     for k, v in diff.items():
         setattr(after_member, k, v) # Horrible hack to do this
     
-    await redis.publish(
+    pipe = redis.pipeline(transaction=False)
+
+    queue_modified_events(
+        pipe,
         f"member_modified.{community_id}.{user_id}",
-        dump_basemodel_to_json_bytes(
-            MemberModifiedEvent(
-                community_id=community_id,
-                user_id=user_id,
-                before = before_member,
-                after = after_member
-            )
+        MemberDeltaEvent(
+            community_id=community_id,
+            user_id=user_id,
+            version=before_resp.get(MEMBER_VERSION_FIELD, 0) + 1,
+            changes=model_delta(before_member, after_member)
+        ),
+        MemberModifiedEvent(
+            community_id=community_id,
+            user_id=user_id,
+            before = before_member,
+            after = after_member
         )
     )
 
+    await pipe.execute()
+
     return after_member
 
+# FIXME: This endpoint is not properly secure, any user can look up a member of any community regardless of whether or not they are part of said community
+@router.post("/{community_id}/members/batch")
+async def get_members_batch(
+    auth_user_id : Annotated[str, Depends(X_USER_HEADER)],
+    community_id : str,
+    batch_request : MemberBatchRequest = Body()
+) -> List[FullMember]:
+    """Resolves many members at once, eg. every author on a page of messages"""
+
+    return await get_full_members(
+        user_ids=batch_request.user_ids,
+        community_id=community_id
+    )
+
 @router.get("/{community_id}/members/search")
 async def members_search() -> List[Member]:
     return # TODO: This isn't a high priority endpoint, will implement when needed
@@ -174,74 +204,28 @@ async def get_member_by_id(
     return member
 
 # FIXME: This endpoint is not properly secure, any user can look up a member of any community regardless of whether or not they are part of said community
-# FIXME: This endpoint will require pagination for better use in the future probably
 # FIXME: This endpoint does not check for the existence of a community
 @router.get("/{community_id}/members")
 async def get_member_list(
     auth_user_id : Annotated[str, Depends(X_USER_HEADER)],
     community_id : str,
+    after : Optional[str] = Query(default=None),
+    limit : int = Query(default=MEMBER_PAGE_SIZE, gt=0, le=MAX_MEMBER_PAGE_SIZE)
 ) -> List[FullMember]:
+    """
+        Returns a page of community members ordered by member id.
+        To get the next page, pass the id of the last member returned as `after`.
+    """
 
     db = await get_database()
 
-    pipeline = db.get_collection("members").aggregate([
-        {
-            "$match" : {
-                "community_id" : ObjectId(community_id)
-            }
-        },
-        {
-            "$lookup" : {
-                "from" : "users",
-                "localField" : "user_id",
-                "foreignField" : "_id",
-                "as" : "found_user_records"
-            }
-        },
-        {
-            "$lookup" : {
-                "from" : "communities",
-                "let" : {
-                    "user_role_ids" : "$role_ids"
-                },
-                "pipeline" : [
-                    {"$unwind" : "$roles"},
-                    {
-                        "$match" : {
-                            "$expr" : {"$in" : ["$roles.id", "$$user_role_ids"]}
-                        }
-                    },
-                    {
-                        "$project" : {
-                            "_id" : 0,
-                            "roles" : "$roles"
-                        }
-                    }
-                ],
-                "as" : "roles"
-            }
-        },
-        {
-            "$addFields" : { # flattens the nested group stuff
-                "roles" : {
-                    "$map" : {
-                        "input" : "$roles",
-                        "as" : "g",
-                        "in" : "$$g.group"
-                    }
-                }
-            }
-        }
-    ])
+    query = {"community_id" : ObjectId(community_id)}
 
-    
+    if after:
+        query["_id"] = {"$gt" : ObjectId(after)}
+
+    member_docs = await db.get_collection("members").find(query).sort("_id", 1).limit(limit).to_list(None)
 
-    return [FullMember(
-        **objectid_fix({
-            "user" : u["found_user_records"][0],
-            "roles" : [Role(**objectid_fix(**ur, desired_outcome="str")) for ur in u['roles']],
-            **u
-        }, desired_outcome="str")
-    ) async for u in pipeline]
+    return await resolve_full_members(member_docs, community_id)
 
 __all__ = [router]
\ No newline at end of file
@@ -3,27 +3,38 @@ from datetime import UTC, datetime
 from bson import ObjectId
 from delve_common._types._dtos._message import Message, MessageContent
 from fastapi import Body, Depends, Query
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRouter
 from typing import Annotated, List, Literal, Optional
 from copy import copy
 from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 
-from ..constants import X_USER_HEADER
+from ..constants import X_USER_HEADER, EXPORT_BATCH_SIZE
+from ..models import BulkMessageCreateRequest, BulkMessageResult
 from ..utils import (
     MessageQueryBuilder,
     dump_basemodel_to_json_bytes, 
     get_mention_tags_from_content_body, 
-    objectid_fix,
+    queue_mention_pings,
+    resolve_mentioned_user_ids,
+    resolve_mentioned_user_ids_many,
 )
+from ..converters import message_converter
+from ..responses import NDJSON_MEDIA_TYPE, ndjson_response, raw_json_list_response
+from ..read_state import queue_messages_sent
+from ..cache import get_channel_slowmode
+from ..ratelimit import check_bulk_message_rate, check_message_rate
+from ..diffs import text_diff, apply_text_diff
+from ..events import CommunityMessageEditedEvent
+from ..models import MessageRevision
 
 from delve_common._db._database import get_database
 from delve_common._db._redis import get_redis
 from delve_common.exceptions import DelveHTTPException
 from delve_common._messages.communities import (
     CommunityMessageCreatedEvent,
-    CommunityMessageDeletedEvent,
-    CommunityMessageModifiedEvent,
-    CommunityMessagePingEvent
+    CommunityMessageDeletedEvent
 )
 
 # --- MESSAGE ENDPOINTS (MAY REQUIRE SOME GATEWAY INTEGRATION)
@@ -48,6 +59,29 @@ async def create_new_message(
     db = await get_database()
     redis = await get_redis()
 
+    # Served from this worker's channel settings cache
+    slowmode_seconds = await get_channel_slowmode(community_id, channel_id)
+
+    if slowmode_seconds is None:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Failed to find channel",
+            identifier="channel_not_found"
+        )
+
+    # Rate limits are checked before anything is written, a flood costs at most one redis call per attempt
+    retry_after = await check_message_rate(user_id, channel_id, slowmode_seconds)
+
+    if retry_after:
+        raise DelveHTTPException(
+            status_code=429,
+            detail="You're sending messages too quickly",
+            identifier="rate_limited",
+            additional_metadata={
+                "retry_after" : retry_after
+            }
+        )
+
     search_for_member = await db.get_collection("members").find_one(
         {"user_id" : ObjectId(user_id)}
     )
@@ -71,7 +105,7 @@ async def create_new_message(
     )
 
     resp = await db.get_collection("community_messages").insert_one(
-        objectid_fix(message.model_dump(), desired_outcome="oid")
+        message_converter.dump(message)
     )
 
     if not resp.inserted_id:
@@ -81,7 +115,14 @@ async def create_new_message(
             identifier="unknown_error_creating_message"
         )
     
-    await redis.publish(
+    mentioned_user_ids = await resolve_mentioned_user_ids(community_id, mentions)
+
+    # The unread counter, the created event and every ping go out in one round trip
+    pipe = redis.pipeline(transaction=False)
+
+    await queue_messages_sent(pipe, channel_id, user_id)
+
+    pipe.publish(
         f"community_message_sent.{community_id}.{channel_id}",
         dump_basemodel_to_json_bytes(
             CommunityMessageCreatedEvent(
@@ -93,22 +134,124 @@ async def create_new_message(
         )
     )
 
-    # handle the mentions
-    # NOTE: `m_id` is stripped of the denoting prefix character
-    for m_id in [m[1:] for m in mentions if m.startswith("@")]:
-        await redis.publish(
-            f"community_user_ping.{m_id}",
+    queue_mention_pings(pipe, community_id, channel_id, message.id, mentioned_user_ids)
+
+    await pipe.execute()
+    
+    return message
+
+
+@router.post("/{community_id}/channels/{channel_id}/messages/bulk")
+async def create_new_messages_bulk(
+    user_id : Annotated[str, Depends(X_USER_HEADER)],
+    community_id : str,
+    channel_id : str,
+    bulk_request : BulkMessageCreateRequest = Body()
+) -> List[BulkMessageResult]:
+    """
+        Creates a batch of messages at once, for imports and bridges.
+        Every message gets a result in request order, with either the created message or the reason it failed.
+    """
+
+    db = await get_database()
+    redis = await get_redis()
+
+    slowmode_seconds = await get_channel_slowmode(community_id, channel_id)
+
+    if slowmode_seconds is None:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Failed to find channel",
+            identifier="channel_not_found"
+        )
+
+    # A batch can't be fitted to slow mode's one message per interval, so bulk sends aren't allowed there
+    if slowmode_seconds:
+        raise DelveHTTPException(
+            status_code=403,
+            detail="Bulk message creation isn't allowed in channels with slow mode on",
+            identifier="slowmode_enabled"
+        )
+
+    retry_after = await check_bulk_message_rate(user_id, channel_id)
+
+    if retry_after:
+        raise DelveHTTPException(
+            status_code=429,
+            detail="You're sending messages too quickly",
+            identifier="rate_limited",
+            additional_metadata={
+                "retry_after" : retry_after
+            }
+        )
+
+    search_for_member = await db.get_collection("members").find_one(
+        {"user_id" : ObjectId(user_id), "community_id" : ObjectId(community_id)}
+    )
+
+    if not search_for_member:
+        raise DelveHTTPException(
+            status_code=401,
+            detail="User is not a member of this community",
+            identifier="user_not_member"
+        )
+
+    messages = [
+        Message(
+            id = str(ObjectId()),
+            author_id = user_id,
+            channel_id = channel_id,
+            community_id = community_id,
+            content = content,
+            mentions = get_mention_tags_from_content_body(content.text)
+        )
+        for content in bulk_request.messages
+    ]
+
+    errors = {}
+
+    try:
+        # Unordered so that one bad message doesn't stop the rest of the batch
+        await db.get_collection("community_messages").insert_many(
+            [message_converter.dump(m) for m in messages],
+            ordered=False
+        )
+    except BulkWriteError as e:
+        errors = {err["index"] : err["errmsg"] for err in e.details.get("writeErrors", [])}
+
+    # Every event and ping for the batch goes out in one round trip
+    pipe = redis.pipeline(transaction=False)
+
+    if len(errors) < len(messages):
+        await queue_messages_sent(pipe, channel_id, user_id, len(messages) - len(errors))
+
+    created = [m for i, m in enumerate(messages) if i not in errors]
+
+    # Every role mentioned across the batch is resolved at once, rather than per message
+    mentioned_user_ids = await resolve_mentioned_user_ids_many(community_id, [m.mentions for m in created])
+
+    for message, user_ids in zip(created, mentioned_user_ids):
+
+        pipe.publish(
+            f"community_message_sent.{community_id}.{channel_id}",
             dump_basemodel_to_json_bytes(
-                CommunityMessagePingEvent(
+                CommunityMessageCreatedEvent(
                     community_id=community_id,
                     channel_id=channel_id,
-                    message_id=message.id
+                    message_id=message.id,
+                    message=message
                 )
             )
         )
-    
-    return message
 
+        queue_mention_pings(pipe, community_id, channel_id, message.id, user_ids)
+
+    await pipe.execute()
+
+    return [
+        BulkMessageResult(index=i, error=errors[i]) if i in errors else BulkMessageResult(index=i, message=message)
+        for i, message in enumerate(messages)
+    ]
 
 @router.get("/{community_id}/channels/{channel_id}/messages")
 async def get_channel_messages(
@@ -147,15 +290,125 @@ async def get_channel_messages(
     if sent_after:
         mqb.set_sent_after(sent_after)
 
-    pipeline = db.get_collection("community_messages").aggregate(mqb.build())
+    pipeline = db.get_collection("community_messages").aggregate([*mqb.build(), {"$project" : message_converter.projection}])
 
-    return [Message(**objectid_fix(msg, desired_outcome="str")) async for msg in pipeline]
+    return raw_json_list_response(pipeline, message_converter)
 
 # TODO: Doing this later as it is not imperative to be finished right away
 @router.get("/{community_id}/channels/{channel_id}/messages/search")
 async def message_search() -> List[Message]:
     return # TODO:
 
+@router.get(
+    "/{community_id}/channels/{channel_id}/messages/export",
+    response_class=StreamingResponse,
+    responses={
+        200 : {
+            "description" : "One Message per line, gzipped when `compress` is set",
+            "content" : {NDJSON_MEDIA_TYPE : {}}
+        }
+    }
+)
+async def export_channel_messages(
+    user_id : Annotated[str, Depends(X_USER_HEADER)],
+    community_id : str,
+    channel_id : str,
+    after : Optional[str] = Query(default=None),
+    compress : bool = Query(default=False)
+) -> StreamingResponse:
+    """
+        Streams the entire channel history as NDJSON, oldest message first.
+        An interrupted export can be resumed by passing the id of the last message received as `after`.
+    """
+
+    db = await get_database()
+
+    search_for_member = await db.get_collection("members").find_one(
+        {"user_id" : ObjectId(user_id), "community_id" : ObjectId(community_id)}
+    )
+
+    if not search_for_member:
+        raise DelveHTTPException(
+            status_code=401,
+            detail="User is not a member of this community",
+            identifier="user_not_member"
+        )
+
+    query = {"community_id" : ObjectId(community_id), "channel_id" : ObjectId(channel_id)}
+
+    # Message ids are monotonic, so they double as the resume cursor
+    if after:
+        query["_id"] = {"$gt" : ObjectId(after)}
+
+    cur = db.get_collection("community_messages").find(query, message_converter.projection).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+
+    return ndjson_response(cur, message_converter, compress=compress)
+
+@router.get("/{community_id}/channels/{channel_id}/messages/{message_id}/revisions")
+async def get_message_revisions(
+    user_id : Annotated[str, Depends(X_USER_HEADER)],
+    community_id : str,
+    channel_id : str,
+    message_id : str,
+    revision : Optional[int] = Query(default=None, ge=0)
+) -> List[MessageRevision]:
+    """
+        Returns the edit history of a message, newest revision first, with the text of every revision
+        rebuilt from the stored diffs. If `revision` is given, only the history back to it is rebuilt.
+    """
+
+    db = await get_database()
+
+    search_for_member = await db.get_collection("members").find_one(
+        {"user_id" : ObjectId(user_id), "community_id" : ObjectId(community_id)}
+    )
+
+    if not search_for_member:
+        raise DelveHTTPException(
+            status_code=401,
+            detail="User is not a member of this community",
+            identifier="user_not_member"
+        )
+
+    msg = await db.get_collection("community_messages").find_one(
+        {"_id" : ObjectId(message_id), "community_id" : ObjectId(community_id), "channel_id" : ObjectId(channel_id)},
+        {"content" : 1, "revision" : 1, "created_at" : 1, "edited_at" : 1}
+    )
+
+    if not msg:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Failed to find message",
+            identifier="message_not_found"
+        )
+
+    latest = msg.get("revision", 0)
+
+    if revision is not None and revision > latest:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Failed to find that revision",
+            identifier="revision_not_found"
+        )
+
+    edits = db.get_collection("message_edits").find(
+        {"message_id" : ObjectId(message_id), "revision" : {"$gt" : revision or 0}}
+    ).sort("revision", -1)
+
+    text = msg["content"]["text"]
+    history = [MessageRevision(
+        revision=latest,
+        text=text,
+        written_at=msg.get("edited_at") if latest else msg.get("created_at")
+    )]
+
+    # Walk backwards from the latest text, each edit holds the diff to the revision before it
+    async for e in edits:
+        text = apply_text_diff(text, e["reverse_diff"])
+        history.append(MessageRevision(revision=e["revision"] - 1, text=text, written_at=e["previous_written_at"]))
+
+    return history
+
 @router.get("/{community_id}/channels/{channel_id}/messages/{message_id}")
 async def get_message_by_id(
     user_id : Annotated[str, Depends(X_USER_HEADER)],
@@ -189,7 +442,7 @@ async def get_message_by_id(
             identifier="message_not_found"
         )
 
-    return Message(**objectid_fix(resp, desired_outcome="str"))
+    return message_converter.load(resp)
 
 @router.delete("/{community_id}/channels/{channel_id}/messages/{message_id}")
 async def delete_message(
@@ -234,6 +487,7 @@ async def delete_message(
     
     # -- If we get to this point we assume that the message exists and the user has the permissions to delete it
     resp = await db.get_collection("community_messages").delete_one({"_id" : ObjectId(message_id)})
+    await db.get_collection("message_edits").delete_many({"message_id" : ObjectId(message_id)})
     
     await redis.publish(
         f"community_message_deleted.{community_id}.{channel_id}.{message_id}",
@@ -292,7 +546,7 @@ async def edit_message(
             identifier="lacking-permissions"
         )
     
-    before_message = Message(**objectid_fix(resp, desired_outcome="str"))
+    before_message = message_converter.load(resp)
 
     after_message = copy(before_message)
     after_message.content = new_message_content
@@ -309,45 +563,63 @@ async def edit_message(
     # Update the edited_at timestamp
     after_message.edited_at = datetime.now(tz=UTC)
 
-    replace_resp = await db.get_collection("community_messages").find_one_and_replace(
-        {"_id" : ObjectId(message_id)},
-        objectid_fix(after_message.model_dump(), desired_outcome="oid"),
-        return_document = ReturnDocument.AFTER
+    # The original message is revision 0, and every edit bumps it
+    revision = resp.get("revision", 0)
+
+    update_resp = await db.get_collection("community_messages").update_one(
+        # Matching on the revision read above means that a concurrent edit can't be silently overwritten
+        {"_id" : ObjectId(message_id), "revision" : revision if revision else {"$in" : [0, None]}},
+        {
+            "$set" : {
+                "content" : after_message.content.model_dump(),
+                "mentions" : after_message.mentions,
+                "edited_at" : after_message.edited_at
+            },
+            "$inc" : {"revision" : 1}
+        }
     )
 
-    if not replace_resp:
+    if update_resp.matched_count != 1:
         raise DelveHTTPException(
-            status_code=500,
-            detail="Something went really wrong",
-            identifier="nightmare_error"
+            status_code=409,
+            detail="The message was edited by another request",
+            identifier="message_edit_conflict"
         )
 
-    await redis.publish(
+    # Store how to get back to the previous revision, the message itself always holds the latest text
+    await db.get_collection("message_edits").insert_one({
+        "message_id" : ObjectId(message_id),
+        "community_id" : ObjectId(community_id),
+        "channel_id" : ObjectId(channel_id),
+        "revision" : revision + 1,
+        "reverse_diff" : text_diff(new_message_content.text, before_message.content.text),
+        "previous_written_at" : before_message.edited_at or before_message.created_at,
+        "edited_at" : after_message.edited_at
+    })
+
+    mentioned_user_ids = await resolve_mentioned_user_ids(community_id, diff_mentions)
+
+    pipe = redis.pipeline(transaction=False)
+
+    pipe.publish(
         f"community_message_modified.{community_id}.{channel_id}.{message_id}",
         dump_basemodel_to_json_bytes(
-            CommunityMessageModifiedEvent(
+            CommunityMessageEditedEvent(
                 community_id=community_id,
                 channel_id=channel_id,
                 message_id=message_id,
-                before=before_message,      # These should dump fine because they're also basemodels
-                after=after_message         # These should dump fine because they're also basemodels
+                revision=revision + 1,
+                diff=text_diff(before_message.content.text, new_message_content.text),
+                mentions=after_message.mentions,
+                edited_at=after_message.edited_at
             )
         )
     )
 
     # handle the uniquely new mentions, because we LOVE sending new pings
-    # NOTE: `m_id` is stripped of the denoting prefix character
-    for m_id in [m[1:] for m in diff_mentions if m.startswith("@")]:
-        await redis.publish(
-            f"community_user_ping.{m_id}",
-            dump_basemodel_to_json_bytes(
-                CommunityMessagePingEvent(
-                    community_id=community_id,
-                    channel_id=channel_id,
-                    message_id=after_message.id
-                )
-            )
-        )
+    queue_mention_pings(pipe, community_id, channel_id, after_message.id, mentioned_user_ids)
+
+    await pipe.execute()
 
     return after_message
 
@@ -1,9 +1,9 @@
 
 from bson import ObjectId
 from delve_common._types._dtos._communities._role import Role
-from fastapi import Body, Depends, Query
+from fastapi import Body, Depends, Header, Query, Response
 from fastapi.routing import APIRouter
-from typing import Annotated, List
+from typing import Annotated, Dict, List, Optional
 from pymongo import ReturnDocument
 
 from delve_common._db._database import get_database
@@ -18,10 +18,21 @@ from delve_common._messages.communities import (
     RolePositionsModified
 )
 
-from ..models import RolePositionsUpdate, RoleSpec
-
-from ..utils import (dump_basemodel_to_json_bytes, objectid_fix, get_full_member)
-from ..constants import X_USER_HEADER
+from ..models import FullMember, RolePositionsUpdate, RoleSpec
+
+from ..utils import (dump_basemodel_to_json_bytes, get_full_member, queue_modified_events, resolve_full_members)
+from ..converters import role_converter
+from ..diffs import model_delta
+from ..events import RoleDeltaEvent
+from ..permissions import ROLES_VERSION_FIELD
+from ..cache import (
+    COMMUNITY_VERSION_FIELD,
+    community_etag,
+    get_community_snapshot,
+    invalidate_community,
+    invalidate_role_members
+)
+from ..constants import X_USER_HEADER, MEMBER_PAGE_SIZE, MAX_MEMBER_PAGE_SIZE, ROLE_REORDER_ATTEMPTS
 
 # --- ROLE ENDPOINTS
 # CREATE A ROLE
@@ -33,6 +44,21 @@ from ..constants import X_USER_HEADER
 
 router = APIRouter()
 
+def reorder_roles(roles : List[Role], requested : Dict[str, int]) -> List[Role]:
+    """
+        Sorts the requested roles in at their requested positions (against the current indexes of
+        the other roles), every other role keeps its relative order and a moved role goes ahead of
+        the role that currently holds its position. O(n log n)
+    """
+
+    # (position, not moved) with a stable sort keeps the unmoved roles in their current order
+    return [
+        role for _, role in sorted(
+            enumerate(roles),
+            key=lambda p: (requested[p[1].id], 0) if p[1].id in requested else (p[0], 1)
+        )
+    ]
+
 @router.post("/{community_id}/roles")
 async def create_role(
     x_user : Annotated[str, Depends(X_USER_HEADER)],
@@ -43,15 +69,20 @@ async def create_role(
     db = await get_database()
     redis = await get_redis()
 
-    resp = await db.get_collection("communities").find_one(
-        {"_id" : ObjectId(community_id)}
-    )
+    snapshot = await get_community_snapshot(community_id)
 
-    comm = Community(**objectid_fix(resp, desired_outcome="str"))
+    if not snapshot:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Failed to find community",
+            identifier="community_not_found"
+        )
+
+    _, comm = snapshot
     member = await get_full_member(x_user, community_id)
 
-    if comm.owner_id != x_user and member.permissions.manage_community is not True:
-        return DelveHTTPException(
+    if comm.owner_id != x_user and not member.has_permission("manage_community"):
+        raise DelveHTTPException(
             status_code=403,
             detail="Lacking Permissions (requires manage_community)",
             identifier="lacking_permissions"
@@ -66,11 +97,14 @@ async def create_role(
         {"_id" : ObjectId(comm.id)},
         {
             "$push" : {
-                "roles" : objectid_fix(role.model_dump(), desired_outcome="oid")
-            }
+                "roles" : role_converter.dump(role)
+            },
+            "$inc" : {ROLES_VERSION_FIELD : 1, COMMUNITY_VERSION_FIELD : 1}
         }
     )
 
+    invalidate_community(community_id)
+
     if resp.matched_count < 1:
         raise DelveHTTPException(
             status_code=404,
@@ -86,7 +120,7 @@ async def create_role(
             identifier="nightmare_error"
         )
     
-    redis.publish(
+    await redis.publish(
         f"role_created.{str(community_id)}.{str(role.id)}",
         dump_basemodel_to_json_bytes(
             RoleCreatedEvent(
@@ -105,16 +139,27 @@ async def create_role(
 @router.get("/{community_id}/roles")
 async def get_role_list(
     x_user : Annotated[str, Depends(X_USER_HEADER)],
-    community_id : str
+    community_id : str,
+    response : Response,
+    if_none_match : Optional[str] = Header(default=None)
 ) -> List[Role]:
-    
-    db = await get_database()
 
-    resp = await db.get_collection("communities").find_one(
-        {"_id" : ObjectId(community_id)}
-    )
+    snapshot = await get_community_snapshot(community_id)
+
+    if not snapshot:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Failed to find community",
+            identifier="community_not_found"
+        )
+
+    version, comm = snapshot
+    etag = community_etag(community_id, version)
 
-    comm = Community.model_validate(objectid_fix(resp, desired_outcome="str"))
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag" : etag})
+
+    response.headers["ETag"] = etag
 
     return comm.roles
 
@@ -123,16 +168,27 @@ async def get_role_list(
 async def get_role(
     x_user : Annotated[str, Depends(X_USER_HEADER)],
     community_id : str,
-    role_id : str
+    role_id : str,
+    response : Response,
+    if_none_match : Optional[str] = Header(default=None)
 ) -> Role:
 
-    db = await get_database()
+    snapshot = await get_community_snapshot(community_id)
 
-    resp = await db.get_collection("communities").find_one(
-        {"_id" : ObjectId(community_id)}
-    )
+    if not snapshot:
+        raise DelveHTTPException(
+            status_code=404,
+            detail="Failed to find community",
+            identifier="community_not_found"
+        )
 
-    comm = Community.model_validate(objectid_fix(resp, desired_outcome="str"))
+    version, comm = snapshot
+    etag = community_etag(community_id, version)
+
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag" : etag})
+
+    response.headers["ETag"] = etag
 
     filtered_roles = [i for i in comm.roles if i.id == role_id]
 
@@ -145,6 +201,31 @@ async def get_role(
 
     return filtered_roles[0]
 
+# FIXME: This endpoint is not properly secure, any user can look up a member of any community regardless of whether or not they are part of said community
+@router.get("/{community_id}/roles/{role_id}/members")
+async def get_role_members(
+    x_user : Annotated[str, Depends(X_USER_HEADER)],
+    community_id : str,
+    role_id : str,
+    after : Optional[str] = Query(default=None),
+    limit : int = Query(default=MEMBER_PAGE_SIZE, gt=0, le=MAX_MEMBER_PAGE_SIZE)
+) -> List[FullMember]:
+    """
+        Returns a page of the members that have a role, ordered by member id.
+        To get the next page, pass the id of the last member returned as `after`.
+    """
+
+    db = await get_database()
+
+    query = {"community_id" : ObjectId(community_id), "role_ids" : ObjectId(role_id)}
+
+    if after:
+        query["_id"] = {"$gt" : ObjectId(after)}
+
+    member_docs = await db.get_collection("members").find(query).sort("_id", 1).limit(limit).to_list(None)
+
+    return await resolve_full_members(member_docs, community_id)
+
 @router.patch("/{community_id}/roles")
 async def update_role_positions(
     x_user : Annotated[str, Depends(X_USER_HEADER)],
@@ -155,39 +236,53 @@ async def update_role_positions(
     db = await get_database()
     redis = await get_redis()
 
-    resp = await db.get_collection("communities").find_one(
-        {"_id" : ObjectId(community_id)}
-    )
+    requested = {str(r.role_id) : r.position for r in role_position_update}
 
-    # get all of the roles
-    roles_arr : list = resp.get("roles", [])
+    # Optimistic concurrency, the reorder only applies if nothing else touched the community since it was read.
+    # The first attempt may be working from this worker's cached snapshot, later ones read fresh.
+    for _ in range(ROLE_REORDER_ATTEMPTS):
 
-    role_pos_tuple_pair = {str(r.role_id) : r.position for r in role_position_update}
-    
-    new_order = sorted(
-        roles_arr,
-        key = lambda n: (
-            roles_arr.index(n) 
-            if str(n["_id"]) not in role_pos_tuple_pair 
-            else role_pos_tuple_pair[str(n["_id"])]
-        )
-    )
+        snapshot = await get_community_snapshot(community_id)
 
-    await db.get_collection("communities").update_one(
-        {"_id" : ObjectId(community_id)},
-        {
-            "$set" : {
-                "roles" : new_order 
+        if not snapshot:
+            raise DelveHTTPException(
+                status_code=404,
+                detail="Failed to find community",
+                identifier="community_not_found"
+            )
+
+        version, comm = snapshot
+        new_order = reorder_roles(comm.roles, requested)
+
+        resp = await db.get_collection("communities").update_one(
+            # Communities that were never modified don't have the version field yet
+            {"_id" : ObjectId(community_id), COMMUNITY_VERSION_FIELD : version if version else {"$in" : [0, None]}},
+            {
+                "$set" : {
+                    "roles" : [role_converter.dump(r) for r in new_order]
+                },
+                "$inc" : {ROLES_VERSION_FIELD : 1, COMMUNITY_VERSION_FIELD : 1}
             }
-        }
-    )
+        )
+
+        invalidate_community(community_id)
+
+        if resp.modified_count:
+            break
+
+    else:
+        raise DelveHTTPException(
+            status_code=409,
+            detail="The roles were modified while reordering them, try again",
+            identifier="role_reorder_conflict"
+        )
 
     await redis.publish(
         f"role_reorder.{str(community_id)}",
         dump_basemodel_to_json_bytes(
             RolePositionsModified(
                 community_id=str(community_id),
-                new_order=[Role(**objectid_fix(i, desired_outcome="str")) for i in new_order]
+                new_order=new_order
             )
         )
     )
@@ -205,47 +300,52 @@ async def update_role(
     db = await get_database()
     redis = await get_redis()
 
-    resp = await db.get_collection("communities").find_one(
+    changes = role_spec.model_dump(exclude_none=True)
+
+    # Updates the one role in place, handing back only that role (as it was) rather than the whole community
+    before_doc = await db.get_collection("communities").find_one_and_update(
+        {"_id" : ObjectId(community_id), "roles._id" : ObjectId(role_id)},
         {
-            "_id" : ObjectId(community_id),
-        }
+            "$set" : {f"roles.$.{k}" : v for k, v in changes.items()},
+            "$inc" : {ROLES_VERSION_FIELD : 1, COMMUNITY_VERSION_FIELD : 1}
+        },
+        projection={"roles.$" : 1, ROLES_VERSION_FIELD : 1},
+        return_document=ReturnDocument.BEFORE
     )
 
-    lookup = [x for x in resp if x["_id"] == ObjectId(role_id)]
-
-    if not lookup:
+    if not before_doc:
         raise DelveHTTPException(
             status_code=404,
             detail="Failed to find role",
             identifier="role_not_found"
         )
-    
-    role_index = resp.index(lookup[0])
-    role = Role(**objectid_fix(**lookup[0], desired_outcome="str"))
-
-    for k, v in role_spec.model_dump(exclude_none=True):
-        setattr(role, k, v)
 
-    resp[role_index] = role.model_dump()
-
-    before_doc = await db.get_collection("communities").find_one_and_update(
-        {"_id" : ObjectId(community_id)},
-        {"roles" : {"$set" : resp}},
-        return_document=ReturnDocument.BEFORE
-    )
-
-    await redis.publish(
-        f"role_updated.{community_id}.{role_id}",
-        dump_basemodel_to_json_bytes(
-            RoleModifiedEvent(
-                community_id=community_id,
-                role_id=role_id,
-                before=Role(**objectid_fix(before_doc, desired_outcome="str")),
-                after=role
-            )
+    before_role = role_converter.load(before_doc["roles"][0])
+    role = before_role.model_copy(update=changes)
+
+    invalidate_community(community_id)
+
+    pipe = redis.pipeline(transaction=False)
+
+    queue_modified_events(
+        pipe,
+        f"role_modified.{community_id}.{role_id}",
+        RoleDeltaEvent(
+            community_id=community_id,
+            role_id=role_id,
+            version=before_doc.get(ROLES_VERSION_FIELD, 0) + 1,
+            changes=model_delta(before_role, role)
+        ),
+        RoleModifiedEvent(
+            community_id=community_id,
+            role_id=role_id,
+            before=before_role,
+            after=role
         )
     )
 
+    await pipe.execute()
+
     return role
 
 @router.delete("/{community_id}/roles/{role_id}")
@@ -258,31 +358,31 @@ async def delete_role(
     db = await get_database()
     redis = await get_redis()
 
-    resp = await db.get_collection("communities").find_one(
+    resp = await db.get_collection("communities").update_one(
+        {"_id" : ObjectId(community_id), "roles._id" : ObjectId(role_id)},
         {
-            "_id" : ObjectId(community_id)
+            "$pull" : {"roles" : {"_id" : ObjectId(role_id)}, "role_ids" : ObjectId(role_id)},
+            "$inc" : {ROLES_VERSION_FIELD : 1, COMMUNITY_VERSION_FIELD : 1}
         }
     )
 
-    roles = resp.get("roles", [])
-
-    if not resp or not roles:
+    if not resp.matched_count:
         raise DelveHTTPException(
             status_code=404,
-            identifier="community_not_found",
-            detail="Community not found"
+            detail="Failed to find role",
+            identifier="role_not_found"
         )
 
-    role_index = [i for i, _ in enumerate(roles) if i["_id"] == ObjectId(role_id)][0]
-
-    roles.pop(role_index)
-
-    await db.get_collection("communities").update_one(
-        {"_id" : ObjectId(community_id)},
-        {"roles" : {"$set" : roles}}
+    # Served by the members role index
+    await db.get_collection("members").update_many(
+        {"community_id" : ObjectId(community_id), "role_ids" : ObjectId(role_id)},
+        {"$pull" : {"role_ids" : ObjectId(role_id)}}
     )
 
-    redis.publish(
+    invalidate_community(community_id)
+    invalidate_role_members(community_id)
+
+    await redis.publish(
         f"role_deleted.{community_id}.{role_id}",
         dump_basemodel_to_json_bytes(
             RoleDeletedEvent(
@@ -6,9 +6,15 @@ from bson import ObjectId
 import re
 
 from .models import FullMember
+from .permissions import ROLES_VERSION_FIELD, get_permission_mask
+from .converters import member_converter, role_converter, user_converter
+from .cache import get_role_members
+from .events import full_event_channel
 from delve_common._db._database import get_database
 from delve_common._types._dtos._communities._role import Role
+from delve_common._types._dtos._user import User
 from delve_common.permissions import Permissions
+from delve_common._messages.communities import CommunityMessagePingEvent
 
 def dump_basemodel_to_json_bytes(m : BaseModel, *, encoding : str = 'utf-8') -> bytes:
     return m.model_dump_json().encode(encoding)
@@ -16,65 +22,6 @@ def dump_basemodel_to_json_bytes(m : BaseModel, *, encoding : str = 'utf-8') ->
 def load_json_bytes(b : bytes, *, encoding : str = 'utf-8') -> dict:
     return loads(b.decode(encoding))
 
-
-def objectid_fix(d : dict, *, desired_outcome : Literal["oid", "str"] = "oid") -> dict:
-    """
-        Takes any dictionary that contains an `id` key and returns one with an objectid `_id` instead.
-        Alternatively, if the key is `_id` it'll swap it to a string `id` instead.
-
-        It will strictly confine to the desired outcome if `desired_outcome` is not set to null.
-        The default behaviour is a toggle.
-    """
-    # This is actually a horrible function
-
-    tmp = {}
-
-    if not isinstance(d, dict):
-        return d
-
-    for k, v in d.items():
-
-        if k == "id" and desired_outcome == "oid":
-            tmp["_id"] = ObjectId(v)
-
-        elif k == "_id" and desired_outcome == "str":
-            tmp["id"] = str(v)
-
-        elif "id" in k:
-
-            if desired_outcome == "oid":
-
-                if isinstance(v, list) and all([ObjectId.is_valid(vx) for vx in v]):
-                    tmp[k] = [ObjectId(vx) for vx in v]
-
-                elif ObjectId.is_valid(v):
-                    tmp[k] = ObjectId(v)
-
-                else:
-                    tmp[k] = v
-
-            elif desired_outcome == "str":
-
-                if isinstance(v, list) and all([isinstance(vx, ObjectId) for vx in v]):
-                    tmp[k] = [str(vx) for vx in v]
-
-                elif isinstance(v, ObjectId):
-                    tmp[k] = str(v)
-
-                else:
-                    tmp[k] = v
-
-        elif isinstance(v, dict):
-            tmp[k] = objectid_fix(v, desired_outcome=desired_outcome)
-
-        elif isinstance(v, list):
-            tmp[k] = [objectid_fix(vi, desired_outcome=desired_outcome) for vi in v]
-
-        else:
-            tmp[k] = v
-
-    return tmp
-
 USER_MENTION_PATTERN = re.compile(r"<(@\w{24})>")
 ROLE_MENTION_PATTERN = re.compile(r"<(&\w{24})>")
 
@@ -97,6 +44,82 @@ def get_mention_tags_from_content_body(
 
     return [*user_mentions, *role_mentions]
 
+async def resolve_mentioned_user_ids_many(
+    community_id : str,
+    mentions_per_message : List[List[str]]
+) -> List[List[str]]:
+    """
+        Turns each message's mention tags into the ids of every user that should be pinged,
+        expanding role mentions into the members holding that role. Duplicates are removed.
+        The roles mentioned anywhere in the batch are resolved together, in at most one query.
+    """
+
+    # NOTE: The ids are stripped of the denoting prefix character
+    role_ids = list(dict.fromkeys(
+        m[1:] for mentions in mentions_per_message for m in mentions
+        if m.startswith("&") and ObjectId.is_valid(m[1:])
+    ))
+
+    role_members = await get_role_members(community_id, role_ids) if role_ids else {}
+
+    resolved = []
+
+    for mentions in mentions_per_message:
+        user_ids = [m[1:] for m in mentions if m.startswith("@")]
+
+        for m in mentions:
+            if m.startswith("&"):
+                user_ids.extend(role_members.get(m[1:], []))
+
+        resolved.append(list(dict.fromkeys(user_ids)))
+
+    return resolved
+
+async def resolve_mentioned_user_ids(
+    community_id : str,
+    mentions : List[str]
+) -> List[str]:
+    """As `resolve_mentioned_user_ids_many`, for a single message"""
+    return (await resolve_mentioned_user_ids_many(community_id, [mentions]))[0]
+
+def queue_mention_pings(
+    pipe,
+    community_id : str,
+    channel_id : str,
+    message_id : str,
+    user_ids : List[str]
+) -> None:
+    """
+        Queues a `community_user_ping` publish for every mentioned user onto a redis pipeline,
+        so that all of a message's pings go out in one round trip when the pipeline is executed.
+    """
+
+    for m_id in user_ids:
+        pipe.publish(
+            f"community_user_ping.{m_id}",
+            dump_basemodel_to_json_bytes(
+                CommunityMessagePingEvent(
+                    community_id=community_id,
+                    channel_id=channel_id,
+                    message_id=message_id
+                )
+            )
+        )
+
+def queue_modified_events(
+    pipe,
+    channel : str,
+    delta_event : BaseModel,
+    full_event : BaseModel
+) -> None:
+    """
+        Queues a `*_modified` delta event onto a redis pipeline, along with the full `before`/`after`
+        event on its `_full` channel. Redis drops the full event if no gateway has opted into it.
+    """
+
+    pipe.publish(channel, dump_basemodel_to_json_bytes(delta_event))
+    pipe.publish(full_event_channel(channel), dump_basemodel_to_json_bytes(full_event))
+
 class MessageQueryBuilder(object):
     """Abstraction for building the message lookup pipeline"""
 
@@ -179,82 +202,93 @@ class MessageQueryBuilder(object):
 class MemberNotFound(Exception):
     pass
 
+# Only the fields that the `User` dto actually needs are pulled from the users collection
+USER_PROJECTION = {k : 1 for k in User.model_fields if k != "id"}
+
+async def resolve_full_members(
+    member_docs : List[dict],
+    community_id : str
+) -> List[FullMember]:
+    """
+        Turns raw member documents into `FullMember`s using one `$in` lookup on users
+        and a single copy of the community's roles, instead of a sub-pipeline per member.
+        The output order matches the order of `member_docs`.
+    """
+
+    if not member_docs:
+        return []
+
+    db = await get_database()
+
+    users_cur = db.get_collection("users").find(
+        {"_id" : {"$in" : [m["user_id"] for m in member_docs]}},
+        USER_PROJECTION
+    )
+
+    users = {u["_id"] : u async for u in users_cur}
+
+    comm = await db.get_collection("communities").find_one(
+        {"_id" : ObjectId(community_id)},
+        {"roles" : 1, ROLES_VERSION_FIELD : 1}
+    )
+
+    # Community roles are stored highest first, so the position doubles as the sort key
+    community_roles = (comm or {}).get("roles", [])
+    roles_version = (comm or {}).get(ROLES_VERSION_FIELD, 0)
+    role_positions = {r["_id"] : i for i, r in enumerate(community_roles)}
+    roles = [role_converter.load(r) for r in community_roles]
+
+    full_members = []
+
+    for m in member_docs:
+
+        # Skip members whose user record has gone missing
+        if m["user_id"] not in users:
+            continue
+
+        member_role_positions = sorted(
+            role_positions[rid] for rid in m.get("role_ids", []) if rid in role_positions
+        )
+
+        full_members.append(FullMember(
+            **member_converter.from_mongo(m),
+            user = user_converter.load(users[m["user_id"]]),
+            roles = [roles[i] for i in member_role_positions],
+            permission_mask = get_permission_mask(
+                community_id,
+                roles_version,
+                [community_roles[i] for i in member_role_positions]
+            )
+        ))
+
+    return full_members
+
+async def get_full_members(
+    user_ids : List[str],
+    community_id : str
+) -> List[FullMember]:
+    """
+        Batch resolves the members of a community for many users at once.
+        Users that aren't members of the community are left out of the result.
+    """
+
+    db = await get_database()
+
+    member_docs = await db.get_collection("members").find({
+        "community_id" : ObjectId(community_id),
+        "user_id" : {"$in" : [ObjectId(u) for u in set(user_ids)]}
+    }).to_list(None)
+
+    return await resolve_full_members(member_docs, community_id)
+
 async def get_full_member(
     user_id : str,
     community_id : str
 ) -> FullMember:
-    
-    # Get the database singleton
-    db = await get_database()
 
-    u = await db.get_collection("members").aggregate([
-        {
-            "$match" : {
-                "community_id" : ObjectId(community_id),
-                "user_id" : ObjectId(user_id)
-            }
-        },
-        {
-            "$lookup" : {
-                "from" : "users",
-                "localField" : "user_id",
-                "foreignField" : "_id",
-                "as" : "found_user_records"
-            }
-        },
-        {
-            "$lookup" : {
-                "from" : "communities",
-                "let" : {
-                    "user_role_ids" : "$role_ids"
-                },
-                "pipeline" : [
-                    {"$unwind" : "$roles"},
-                    {
-                        "$match" : {
-                            "$expr" : {"$in" : ["$roles.id", "$$user_role_ids"]}
-                        }
-                    },
-                    {
-                        "$project" : {
-                            "_id" : 0,
-                            "roles" : "$roles"
-                        }
-                    }
-                ],
-                "as" : "roles"
-            }
-        },
-        {
-            "$addFields" : { # flattens the nested group stuff
-                "roles" : {
-                    "$map" : {
-                        "input" : "$roles",
-                        "as" : "g",
-                        "in" : "$$g.group"
-                    }
-                }
-            }
-        }
-    ]).to_list()
+    members = await get_full_members([user_id], community_id)
 
-    if not u:
+    if not members:
         raise MemberNotFound
-    
-    u = u[0]
-
-    user_ref = u["found_user_records"][0]
-    del u["found_user_records"][0]
-
-    roles = [Role(**objectid_fix(**g, desired_outcome="str")) for g in u["roles"]]
-    del u["roles"]
-
-    return FullMember(
-        **objectid_fix({
-            "user" : user_ref,
-            "roles" : roles,
-            **u
-        },
-        desired_outcome="str"
-        )
-    )
\ No newline at end of file
+
+    return members[0]
@@ -0,0 +1,74 @@
+"""
+    Concurrent joins against one limited invite. Needs a mongo to write to, on MONGO_URI,
+    and motor (which comes with delve_common). Skipped otherwise, so nothing runs it unattended.
+
+    Run from microservices/communities: `python -m pytest tests`
+"""
+
+import asyncio
+from os import getenv
+
+import pytest
+from bson import ObjectId
+
+motor_asyncio = pytest.importorskip("motor.motor_asyncio")
+pytest.importorskip("delve_common")
+
+from src.invite_usage import claim_invite_use, release_invite_use
+
+MONGO_URI = getenv("MONGO_URI")
+
+pytestmark = pytest.mark.skipif(not MONGO_URI, reason="MONGO_URI is not set")
+
+JOINS = 500
+MAX_USES = 25
+
+async def _with_invite(test) -> None:
+    client = motor_asyncio.AsyncIOMotorClient(MONGO_URI)
+    db = client[f"delve_test_{ObjectId()}"]
+
+    try:
+        invites = db.get_collection("invites")
+        invite_id = (await invites.insert_one({"invite_code" : "aaaaaa", "max_uses" : MAX_USES, "uses" : 0})).inserted_id
+
+        await test(invites, invite_id)
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+def test_claims_never_exceed_max_uses() -> None:
+
+    async def test(invites, invite_id) -> None:
+        claimed = await asyncio.gather(*(claim_invite_use(invites, invite_id, MAX_USES) for _ in range(JOINS)))
+
+        assert sum(claimed) == MAX_USES
+        assert (await invites.find_one({"_id" : invite_id}))["uses"] == MAX_USES
+
+    asyncio.run(_with_invite(test))
+
+def test_released_uses_can_be_claimed_again() -> None:
+
+    async def join(invites, invite_id, already_member : bool) -> bool:
+        if not await claim_invite_use(invites, invite_id, MAX_USES):
+            return False
+
+        # A join that turned out to be a duplicate hands its use back
+        if already_member:
+            await release_invite_use(invites, invite_id)
+            return False
+
+        return True
+
+    async def test(invites, invite_id) -> None:
+        joined = await asyncio.gather(*(join(invites, invite_id, i % 3 == 0) for i in range(JOINS)))
+
+        # Joins racing a duplicate's claim may be turned away, but every use left counted is a real join
+        assert sum(joined) <= MAX_USES
+        assert (await invites.find_one({"_id" : invite_id}))["uses"] == sum(joined)
+
+        remaining = MAX_USES - sum(joined)
+        claimed = await asyncio.gather(*(claim_invite_use(invites, invite_id, MAX_USES) for _ in range(JOINS)))
+
+        assert sum(claimed) == remaining
+
+    asyncio.run(_with_invite(test))
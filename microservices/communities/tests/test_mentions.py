@@ -0,0 +1,44 @@
+"""
+    Mention tag extraction from message content, and resolving mentions into the users to ping.
+
+    Run from microservices/communities: `python -m pytest tests`
+"""
+
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+pytest.importorskip("delve_common")
+
+import src.utils
+from src.utils import get_mention_tags_from_content_body
+
+def test_extracts_user_and_role_mentions() -> None:
+    user_id, role_id = str(ObjectId()), str(ObjectId())
+
+    tags = get_mention_tags_from_content_body(f"hey <@{user_id}> and <&{role_id}>")
+
+    assert tags == [f"@{user_id}", f"&{role_id}"]
+
+def test_ignores_malformed_mentions() -> None:
+    assert get_mention_tags_from_content_body("hey <@123> and @everyone") == []
+
+def test_batch_resolves_roles_once(monkeypatch) -> None:
+    user_id, role_a, role_b = str(ObjectId()), str(ObjectId()), str(ObjectId())
+    members = {role_a : ["1", "2"], role_b : ["2", "3"]}
+    calls = []
+
+    async def get_role_members(community_id, role_ids):
+        calls.append(role_ids)
+        return {r : members[r] for r in role_ids}
+
+    monkeypatch.setattr(src.utils, "get_role_members", get_role_members)
+
+    resolved = asyncio.run(src.utils.resolve_mentioned_user_ids_many(
+        str(ObjectId()),
+        [[f"@{user_id}", f"&{role_a}"], [f"&{role_a}", f"&{role_b}"], []]
+    ))
+
+    assert calls == [[role_a, role_b]]
+    assert resolved == [[user_id, "1", "2"], ["1", "2", "3"], []]
@@ -1,7 +1,7 @@
 import asyncio
 from typing import Annotated, AsyncIterator
 from bson import ObjectId
-from fastapi import Depends, FastAPI, WebSocket
+from fastapi import Depends, FastAPI, Query, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 import json
 from asyncio import Queue
@@ -13,7 +13,7 @@ from delve_common._db._redis import DelveRedis, get_redis
 from .models import GatewayState
 from .event_handler import EventHandler
 from .event_listener import EventListener
-from .messages import HeartbeatRequest, HeartbeatResponse, StateResponse, StateRequest
+from .messages import HeartbeatRequest, HeartbeatResponse, StateResponse, StateRequest, TypingStart
 from .auth import get_cookie_or_token, process_jwt_token
 
 from .event_handlers.state_handlers import (
@@ -25,6 +25,7 @@ from .event_handlers.state_handlers import (
     community_deleted_handler,
     util_get_all_redis_channels
 )
+from .event_handlers.typing_handlers import typing_start_handler, user_typing_handler
 
 app = FastAPI()
 
@@ -42,7 +43,8 @@ DelveRedis.using_app(app)
 @app.websocket("/")
 async def websocket_gateway(
     websocket : WebSocket,
-    token : Annotated[str, Depends(get_cookie_or_token)]
+    token : Annotated[str, Depends(get_cookie_or_token)],
+    full_events : Annotated[bool, Query()] = False
 ):
     if not token:
         raise ValueError("Not auth'n'ed.")
@@ -56,7 +58,7 @@ async def websocket_gateway(
         ignore_subscribe_messages=True
     )
 
-    gateway_state = GatewayState(websocket, user_id, pubsub=redis_pubsub)
+    gateway_state = GatewayState(websocket, user_id, pubsub=redis_pubsub, full_events=full_events)
     internal_queue = []
 
     await websocket.accept()
@@ -73,7 +75,9 @@ async def websocket_gateway(
 
     community_list = await cursor.to_list(None)
 
-    channels_to_listen_to = [util_get_all_redis_channels(c["community_id"]) for c in community_list]
+    gateway_state.joined_community_ids.update(str(c["community_id"]) for c in community_list)
+
+    channels_to_listen_to = [util_get_all_redis_channels(c["community_id"], full_events) for c in community_list]
 
     reduced_channels = [
         chan 
@@ -114,7 +118,7 @@ async def websocket_gateway(
 
     # Add the sources to the event listener
     event_listener = EventListener()
-    event_listener.add_event_source("ws", from_ws_iterator, valid_events=[StateResponse, HeartbeatResponse])
+    event_listener.add_event_source("ws", from_ws_iterator, valid_events=[StateResponse, HeartbeatResponse, TypingStart])
     event_listener.add_event_source("redis", from_redis_pubsub_iterator)
     event_listener.add_event_source("heartbeat", heartbeat_request, valid_events=[HeartbeatRequest])
     # endregion
@@ -128,6 +132,8 @@ async def websocket_gateway(
     event_handler.register_handler("left_community", left_community_handler)
     event_handler.register_handler("community_created", community_created_handler)
     event_handler.register_handler("community_deleted", community_deleted_handler)
+    event_handler.register_handler("typing_start", typing_start_handler)
+    event_handler.register_handler("user_typing", user_typing_handler)
 
     # All of the message forwards
     event_handler.add_event_forwards(
@@ -135,6 +141,7 @@ async def websocket_gateway(
         'community_modified',
         'community_deleted',
         "joined_community",
+        "members_joined",
         "left_community",
         "member_modified",
         "channel_created",
@@ -5,6 +5,7 @@ from bson import ObjectId
 from ..models import GatewayState
 from copy import copy
 from .ack import assert_gateway_readiness
+from .typing_handlers import util_get_typing_redis_channel
 from ..messages import (
     HeartbeatResponse,
     StateResponse, 
@@ -21,10 +22,14 @@ from delve_common._db._database import get_database
 
 # region Util
 
-def util_get_community_redis_channels(community_id : str):
+def util_modified_prefix(prefix : str, full_events : bool = False) -> str:
+    """The full before/after variants of the *_modified events are published on a `_full` channel"""
+    return f"{prefix}_full" if full_events else prefix
+
+def util_get_community_redis_channels(community_id : str, full_events : bool = False):
     return [
         f"community_deleted.{community_id}",
-        f"community_modified.{community_id}",
+        f"{util_modified_prefix('community_modified', full_events)}.{community_id}",
     ]
 
 def util_get_channel_redis_channels(community_id : str, channel_id : Optional[str] = "*"):
@@ -34,27 +39,28 @@ def util_get_channel_redis_channels(community_id : str, channel_id : Optional[st
         f"channel_deleted.{community_id}.{channel_id}",
     ]
 
-def util_get_member_redis_channels(community_id : str, user_id : Optional[str] = "*"):
+def util_get_member_redis_channels(community_id : str, user_id : Optional[str] = "*", full_events : bool = False):
     return [
-        f"member_joined.{community_id}.{user_id}",
+        # Joins are batched per community, a user's own `member_joined` is subscribed to separately
+        f"members_joined.{community_id}",
         f"member_left.{community_id}.{user_id}",
-        f"member_modified.{community_id}.{user_id}"
+        f"{util_modified_prefix('member_modified', full_events)}.{community_id}.{user_id}"
     ]
 
-def util_get_role_channels(community_id : str):
+def util_get_role_channels(community_id : str, full_events : bool = False):
     return [
         f"role.created.{community_id}.*",
         f"role_deleted.{community_id}.*",
-        f"role_modified.{community_id}.*",
+        f"{util_modified_prefix('role_modified', full_events)}.{community_id}.*",
         f"role_reorder.{community_id}"
     ]
 
-def util_get_all_redis_channels(community_id : str):
+def util_get_all_redis_channels(community_id : str, full_events : bool = False):
     return [
-        *util_get_community_redis_channels(community_id),
+        *util_get_community_redis_channels(community_id, full_events),
         *util_get_channel_redis_channels(community_id),
-        *util_get_member_redis_channels(community_id),
-        *util_get_role_channels(community_id)
+        *util_get_member_redis_channels(community_id, full_events=full_events),
+        *util_get_role_channels(community_id, full_events)
     ]
 
 # endregion
@@ -85,15 +91,19 @@ async def update_view_state(d : dict, gateway_state : GatewayState) -> None:
         await gateway_state.pubsub.psubscribe(
             f"community_message_sent.{gateway_state.current_community_id}.{gateway_state.current_channel_id}",
             f"community_message_modified.{gateway_state.current_community_id}.{gateway_state.current_channel_id}.*",
-            f"community_message_deleted.{gateway_state.current_community_id}.{gateway_state.current_channel_id}.*"
+            f"community_message_deleted.{gateway_state.current_community_id}.{gateway_state.current_channel_id}.*",
+            util_get_typing_redis_channel(gateway_state.current_community_id, gateway_state.current_channel_id)
         )
 
-    # Unsubscribe from the old message events
-    if old_state.current_channel_id or old_state.current_community_id:
-        await gateway_state.pubsub.unsubscribe(
-            f"community_message_sent.{old_state.current_community_id}.{old_state.current_channel_id}"
+    # Unsubscribe from the old message events (unless the view didn't actually change)
+    view_changed = (old_state.current_community_id, old_state.current_channel_id) != (resp.community_id, resp.channel_id)
+
+    if view_changed and (old_state.current_channel_id or old_state.current_community_id):
+        await gateway_state.pubsub.punsubscribe(
+            f"community_message_sent.{old_state.current_community_id}.{old_state.current_channel_id}",
             f"community_message_modified.{old_state.current_community_id}.{old_state.current_channel_id}.*",
-            f"community_message_deleted.{old_state.current_community_id}.{old_state.current_channel_id}.*"
+            f"community_message_deleted.{old_state.current_community_id}.{old_state.current_channel_id}.*",
+            util_get_typing_redis_channel(old_state.current_community_id, old_state.current_channel_id)
         )
 
     gateway_state.ack.state_request_recv = True
@@ -104,7 +114,9 @@ async def update_view_state(d : dict, gateway_state : GatewayState) -> None:
 async def community_deleted_handler(d : dict, gateway_state : GatewayState) -> None:
     resp = CommunityDeletedEvent(**d)
 
-    await gateway_state.pubsub.unsubscribe(*util_get_all_redis_channels(resp.community_id))
+    gateway_state.joined_community_ids.discard(resp.community_id)
+
+    await gateway_state.pubsub.unsubscribe(*util_get_all_redis_channels(resp.community_id, gateway_state.full_events))
 
 # "left_community"
 async def left_community_handler(d : dict, gateway_state : GatewayState) -> None:
@@ -113,9 +125,12 @@ async def left_community_handler(d : dict, gateway_state : GatewayState) -> None
 
     if (gateway_state.user_id == resp.user_id):
 
+        gateway_state.joined_community_ids.discard(resp.community_id)
+
         return await gateway_state.pubsub.unsubscribe(
             *util_get_community_redis_channels(
-                resp.community_id
+                resp.community_id,
+                gateway_state.full_events
             )
         )
 
@@ -126,8 +141,10 @@ async def joined_community_handler(d : dict, gateway_state : GatewayState) -> No
 
     if resp.user_id == gateway_state.user_id:
 
+        gateway_state.joined_community_ids.add(resp.community_id)
+
         return await gateway_state.pubsub.psubscribe(
-            *util_get_all_redis_channels(resp.community_id)
+            *util_get_all_redis_channels(resp.community_id, gateway_state.full_events)
         )
     
 # "community_created"
@@ -136,7 +153,8 @@ async def community_created_handler(d : dict, gateway_state : GatewayState) -> N
     resp = CommunityCreatedEvent(**d)
 
     if resp.community.owner_id == gateway_state.user_id:
-        await gateway_state.pubsub.psubscribe(*util_get_all_redis_channels(resp.community_id))
+        gateway_state.joined_community_ids.add(resp.community_id)
+        await gateway_state.pubsub.psubscribe(*util_get_all_redis_channels(resp.community_id, gateway_state.full_events))
 
 async def heartbeat_response_handler(d : dict, gateway_state : GatewayState) -> None:
 
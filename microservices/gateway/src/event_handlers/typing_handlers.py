@@ -0,0 +1,60 @@
+from time import monotonic
+
+from ..models import GatewayState
+from ..messages import TypingStart, UserTyping
+from delve_common._db._redis import get_redis
+
+# A user can only publish one typing event per channel in this window
+TYPING_RATE_LIMIT_SECONDS = 3.0
+
+# Repeat typing events for the same user and channel inside this window are dropped
+TYPING_COALESCE_SECONDS = 3.0
+
+def util_get_typing_redis_channel(community_id : str, channel_id : str) -> str:
+    return f"user_typing.{community_id}.{channel_id}"
+
+# "typing_start"
+async def typing_start_handler(d : dict, gateway_state : GatewayState) -> None:
+
+    req = TypingStart(**d)
+
+    # Only members of the community (which this gateway is already subscribed to) can type in it
+    if req.community_id not in gateway_state.joined_community_ids:
+        return
+
+    now = monotonic()
+
+    if now - gateway_state.last_typing_sent.get(req.channel_id, 0) < TYPING_RATE_LIMIT_SECONDS:
+        return
+
+    gateway_state.last_typing_sent[req.channel_id] = now
+
+    redis = await get_redis()
+
+    await redis.publish(
+        util_get_typing_redis_channel(req.community_id, req.channel_id),
+        UserTyping(
+            community_id=req.community_id,
+            channel_id=req.channel_id,
+            user_id=gateway_state.user_id
+        ).model_dump_json().encode("utf-8")
+    )
+
+# "user_typing"
+async def user_typing_handler(d : dict, gateway_state : GatewayState) -> None:
+
+    resp = UserTyping(**d)
+
+    # Don't echo the user's own typing back to them
+    if resp.user_id == gateway_state.user_id:
+        return
+
+    key = (resp.channel_id, resp.user_id)
+    now = monotonic()
+
+    if now - gateway_state.last_typing_forwarded.get(key, 0) < TYPING_COALESCE_SECONDS:
+        return
+
+    gateway_state.last_typing_forwarded[key] = now
+
+    await gateway_state.websocket.send_json(resp.model_dump())
@@ -22,3 +22,18 @@ class HeartbeatRequest(BaseEvent):
 class HeartbeatResponse(BaseEvent):
     event: Literal["heartbeat_response"] = "heartbeat_response"
 
+class TypingStart(BaseEvent):
+    """Sent up by clients while the user is typing in a channel"""
+    event : Literal["typing_start"] = "typing_start"
+
+    community_id : str
+    channel_id : str
+
+class UserTyping(BaseEvent):
+    """Fanned out to everyone viewing the channel, this is never persisted"""
+    event : Literal["user_typing"] = "user_typing"
+
+    community_id : str
+    channel_id : str
+    user_id : str
+
@@ -1,30 +1,48 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 from fastapi import WebSocket
 from pydantic import BaseModel, Field
 from redis.client import PubSub
 
 class GatewayState(object):
 
-    def __init__(self, websocket : WebSocket, user_id : str, pubsub : PubSub) -> None:
+    def __init__(self, websocket : WebSocket, user_id : str, pubsub : PubSub, *, full_events : bool = False) -> None:
 
         self.websocket = websocket
         self.user_id = user_id
         self.pubsub = pubsub
+        self.full_events = full_events
 
         # Init defaults
         self.ack = Acknowledgements()
         self.current_channel_id = None
         self.current_community_id = None 
+        self.joined_community_ids = set()
+
+        # Typing indicator bookkeeping, as monotonic timestamps
+        self.last_typing_sent = {}
+        self.last_typing_forwarded = {}
 
     websocket : WebSocket
     pubsub : PubSub
     user_id : str
 
+    # Whether the client asked for full `before`/`after` *_modified events instead of deltas
+    full_events : bool
+
     current_community_id : Optional[str]
     current_channel_id : Optional[str]
 
+    # The communities this connection is subscribed to the events of
+    joined_community_ids : Set[str]
+
     ack : "Acknowledgements"
 
+    # channel_id -> when this user last published a typing event to it
+    last_typing_sent : Dict[str, float]
+
+    # (channel_id, user_id) -> when a typing event was last forwarded to this client
+    last_typing_forwarded : Dict[Tuple[str, str], float]
+
     @property
     def no_channel_in_view(self) -> bool:
         return self.current_channel_id is None and self.current_community_id is None
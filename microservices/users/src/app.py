@@ -19,7 +19,9 @@ from delve_common._types._dtos import User
 from delve_common.exceptions import DelveHTTPException
 
 from .models import UserRegistration
-from .utils import ensure_vacant_username, objectid_fix
+from .utils import ensure_vacant_username
+from .converters import user_converter
+from .indexes import Indexes
 
 app = FastAPI()
 
@@ -40,6 +42,7 @@ firebase_admin.initialize_app(
     options={"projectId" : getenv("FIREBASE_PROJECT_ID")})
 
 Database.using_app(app)
+Indexes.using_app(app)
 
 @app.post("/register")
 async def register_user(
@@ -98,7 +101,7 @@ async def register_user(
     assert user_record.uid == str(user_id), "Inconsistent user record"
 
     inserted_record = await db.get_collection("users").insert_one(
-        objectid_fix(user.model_dump(), desired_outcome="oid")
+        user_converter.dump(user)
     )
 
     # If the user doesn't get inserted into mongodb...
@@ -208,7 +211,7 @@ async def update_user(
         )
     
     # If the record isn't null, return that as the updated user in response
-    return User(**objectid_fix(record, desired_outcome="str"))
+    return user_converter.load(record)
     
 
 @app.get("/{user_id}")
@@ -231,4 +234,4 @@ async def get_user(
             additional_metadata={"user_searched_for" : user_id}
         )
 
-    return User(**objectid_fix(record, desired_outcome="str"))
\ No newline at end of file
+    return user_converter.load(record)
\ No newline at end of file
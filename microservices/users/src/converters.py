@@ -0,0 +1,143 @@
+from typing import Any, Callable, Generic, List, Tuple, Type, TypeVar, Union, get_args, get_origin
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel
+
+from delve_common._types._dtos import User
+
+M = TypeVar("M", bound=BaseModel)
+
+def _to_oid(v : Any) -> Any:
+    if v is None or isinstance(v, ObjectId):
+        return v
+
+    try:
+        return ObjectId(v)
+    except (InvalidId, TypeError):
+        return v
+
+def _to_str(v : Any) -> Any:
+    return str(v) if isinstance(v, ObjectId) else v
+
+def _unwrap_annotation(annotation : Any) -> Tuple[Any, bool]:
+    """Strips `Optional`/`Union[..., None]` and returns `(inner type, is_list)`"""
+
+    while get_origin(annotation) is Union:
+        args = [a for a in get_args(annotation) if a is not type(None)]
+
+        if len(args) != 1:
+            return annotation, False
+
+        annotation = args[0]
+
+    if get_origin(annotation) in (list, List):
+        return _unwrap_annotation(get_args(annotation)[0])[0], True
+
+    return annotation, False
+
+class DocumentConverter(Generic[M]):
+    """
+        A schema-driven replacement for `objectid_fix`, built once per dto.
+        The dto's fields are inspected up front, so converting a document is a single pass
+        over just the fields that hold ObjectIds, instead of a recursive walk over every key.
+    """
+
+    model : Type[M]
+
+    # The field names that hold a single ObjectId / a list of ObjectIds
+    id_fields : Tuple[str, ...]
+    id_list_fields : Tuple[str, ...]
+
+    # Fields holding other dtos that themselves contain ObjectIds
+    nested_fields : Tuple[Tuple[str, "DocumentConverter", bool], ...]
+
+    def __init__(self, model : Type[M]) -> None:
+
+        self.model = model
+
+        id_fields, id_list_fields, nested_fields = [], [], []
+
+        for name, field in model.model_fields.items():
+
+            if name == "id":
+                continue
+
+            inner, is_list = _unwrap_annotation(field.annotation)
+
+            if name.endswith("_id"):
+                id_fields.append(name)
+
+            elif name.endswith("_ids"):
+                id_list_fields.append(name)
+
+            elif isinstance(inner, type) and issubclass(inner, BaseModel):
+                nested = DocumentConverter(inner)
+
+                if nested.has_ids:
+                    nested_fields.append((name, nested, is_list))
+
+        self.id_fields = tuple(id_fields)
+        self.id_list_fields = tuple(id_list_fields)
+        self.nested_fields = tuple(nested_fields)
+
+    @property
+    def has_ids(self) -> bool:
+        return "id" in self.model.model_fields or bool(self.id_fields or self.id_list_fields or self.nested_fields)
+
+    def __convert(
+        self,
+        d : dict,
+        from_key : str,
+        to_key : str,
+        f : Callable[[Any], Any],
+        nested : Callable[["DocumentConverter", dict], dict]
+    ) -> dict:
+
+        out = dict(d)
+
+        if from_key in out:
+            out[to_key] = f(out.pop(from_key))
+
+        for k in self.id_fields:
+            if k in out:
+                out[k] = f(out[k])
+
+        for k in self.id_list_fields:
+            if out.get(k):
+                out[k] = [f(v) for v in out[k]]
+
+        for k, converter, is_list in self.nested_fields:
+            v = out.get(k)
+
+            if not v:
+                continue
+
+            if is_list:
+                out[k] = [nested(converter, vi) if isinstance(vi, dict) else vi for vi in v]
+
+            elif isinstance(v, dict):
+                out[k] = nested(converter, v)
+
+        return out
+
+    def to_mongo(self, d : dict) -> dict:
+        """`id` -> `_id`, and every id field as an ObjectId"""
+        return self.__convert(d, "id", "_id", _to_oid, DocumentConverter.to_mongo)
+
+    def from_mongo(self, d : dict) -> dict:
+        """`_id` -> `id`, and every id field as a string"""
+        return self.__convert(d, "_id", "id", _to_str, DocumentConverter.from_mongo)
+
+    def load(self, d : dict) -> M:
+        return self.model(**self.from_mongo(d))
+
+    def dump(self, m : M) -> dict:
+        return self.to_mongo(m.model_dump())
+
+user_converter : DocumentConverter[User] = DocumentConverter(User)
+
+__all__ = [
+    DocumentConverter,
+    user_converter
+]
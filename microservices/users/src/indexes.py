@@ -0,0 +1,86 @@
+from os import getenv
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import FastAPI
+from pymongo import ASCENDING, IndexModel
+
+from delve_common._db._database import get_database
+
+# Every index that this service relies on, keyed by collection
+INDEXES : Dict[str, List[IndexModel]] = {
+    "users" : [
+        IndexModel([("username", ASCENDING)], unique=True, name="users_username_index"),
+    ],
+}
+
+# (collection, filter, sort) for every query shape used in `src`, checked by `verify_query_plans`
+QUERY_SHAPES : List[Tuple[str, dict, Optional[List[Tuple[str, int]]]]] = [
+    ("users", {"username" : "username"}, None),
+]
+
+class QueryPlanError(Exception):
+    pass
+
+async def apply_indexes() -> None:
+
+    db = await get_database()
+
+    for collection, indexes in INDEXES.items():
+        await db.get_collection(collection).create_indexes(indexes)
+
+def find_collscans(plan : dict) -> List[dict]:
+    """Walks an explain() plan tree and returns every COLLSCAN stage in it"""
+
+    found = [plan] if plan.get("stage") == "COLLSCAN" else []
+
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            found.extend(find_collscans(plan[key]))
+
+    for child in plan.get("inputStages", []):
+        found.extend(find_collscans(child))
+
+    return found
+
+async def verify_query_plans() -> None:
+    """Explains every registered query shape, raising `QueryPlanError` if any of them scan a whole collection"""
+
+    db = await get_database()
+
+    failures = []
+
+    for collection, query, sort in QUERY_SHAPES:
+        cur = db.get_collection(collection).find(query)
+
+        if sort:
+            cur = cur.sort(sort)
+
+        explanation = await cur.explain()
+
+        if find_collscans(explanation["queryPlanner"]["winningPlan"]):
+            failures.append((collection, query))
+
+    if failures:
+        raise QueryPlanError(f"Queries falling back to COLLSCAN: {failures}")
+
+class Indexes(object):
+
+    @classmethod
+    def using_app(cls, app : FastAPI) -> None:
+
+        @app.on_event("startup")
+        async def bootstrap_indexes() -> None:
+            await apply_indexes()
+
+            # Check mode, intended for CI and staging rather than every pod start
+            if getenv("VERIFY_QUERY_PLANS", "false").lower() == "true":
+                await verify_query_plans()
+
+__all__ = [
+    INDEXES,
+    QUERY_SHAPES,
+    QueryPlanError,
+    apply_indexes,
+    verify_query_plans,
+    Indexes
+]